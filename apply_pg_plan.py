@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""
+    Applies DDL of gen_pg_tabs.py --apply-plan to PG:
+    phases one after another, streams of a phase in parallel sessions
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+import postgresql # pip install py-postgresql
+from tqdm import tqdm
+
+from logsetup import add_log_args, start_logging
+
+LOGGER = logging.getLogger(__name__)
+
+
+def apply_stream(uri, plan_dir, stream, pbar, failed):
+    """ execute files of stream one by one in own PG session """
+    dbpg = postgresql.open(uri)
+    try:
+        for relname in stream:
+            with open(os.path.join(plan_dir, relname)) as file:
+                sql = file.read()
+            LOGGER.debug(relname)
+            try:
+                dbpg.execute(sql)
+            except postgresql.exceptions.Error as ex:
+                LOGGER.error('%s: %s', relname, ex)
+                failed.append(relname)
+            pbar.update(1)
+    finally:
+        dbpg.close()
+
+
+def apply_phase(phase, args) -> list:
+    """ run streams of phase in parallel, returns failed files """
+    plan_dir = os.path.dirname(os.path.abspath(args.plan_file))
+    failed = []
+    pbar = tqdm(desc=phase['phase'], total=sum([len(stream) for stream in phase['streams']]))
+    threads = [threading.Thread(target=apply_stream, name='%s %d' % (phase['phase'], n),
+                                args=(args.pg_uri, plan_dir, stream, pbar, failed))
+               for n, stream in enumerate(phase['streams'])]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pbar.close()
+    return failed
+
+
+def main(args):
+    """ main """
+    with open(args.plan_file) as file:
+        phases = json.load(file)['phases']
+
+    for phase in phases:
+        if args.phases and phase['phase'] not in args.phases:
+            continue
+        start = time.time()
+        failed = apply_phase(phase, args)
+        resstr = '%s: %d sessions, %.1fs, failed: %s' % (
+            phase['phase'], len(phase['streams']), time.time() - start, ', '.join(failed) or '-')
+        LOGGER.info(resstr)
+        print(resstr)
+        if failed:
+            print('Phase %s failed, next phases are not applied' % phase['phase'])
+            return 1
+    return 0
+
+
+def parse_arg():
+    """ parse program options """
+    parser = argparse.ArgumentParser(description="Apply gen_pg_tabs.py plan to PG")
+    parser.add_argument('--phase', dest='phases', action='append',
+                        help='apply only this phase (tables, indexes, primary keys, '
+                             'foreign keys, validate), may be repeated')
+    add_log_args(parser, 'apply_pg_plan.log')
+    parser.add_argument(dest='plan_file', help='apply_plan.json written by gen_pg_tabs.py -a')
+    parser.add_argument(dest='pg_uri', help='PG connect string, pq://...')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arg()
+    start_logging(args)
+    LOGGER.info(' '.join(sys.argv))
+    sys.exit(main(args))
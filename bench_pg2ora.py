@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""
+    Benchmark of pg2ora.py source paths: prepared statement chunks against
+    COPY (query) TO STDOUT parsed in bulk (--use-copy), optionally inserting
+    the rows to oracle table of the same name and rolling them back
+"""
+
+import sys
+import time
+import argparse
+import postgresql # pip install py-postgresql
+import cx_Oracle # pip install cx_Oracle
+
+from ora2pg import tabs2list, ora_copy_session
+from pg2ora import copy_out_batches
+
+
+def chunks_batches(dbpg, query, pgq, batch_rowcount):
+    """ default pg2ora.py path """
+    return pgq.chunks()
+
+
+PATHS = (('chunks', chunks_batches), ('copy', copy_out_batches))
+
+
+def run_path(batches, curs, ora_query) -> tuple:
+    """ (rows, seconds) of reading all batches, inserting them if curs is given """
+    rows = 0
+    start = time.monotonic()
+    for batch in batches:
+        if curs is not None:
+            curs.executemany(ora_query, batch, batcherrors=True)
+            errors = len(curs.getbatcherrors())
+            if errors:
+                print('  %d rows failed to insert' % errors)
+        rows += len(batch)
+    seconds = time.monotonic() - start
+    if curs is not None:
+        curs.execute("rollback")
+    return rows, seconds
+
+
+def bench_table(dbpg, curs, tab, args):
+    """ every path --runs times, best time of each """
+    query = "select * from " + tab
+    pgq = dbpg.prepare(query)
+    cols = pgq.column_names
+    ora_query = "insert into " + tab + "(" + ','.join(cols) + ") " + \
+                "values (" + ','.join([":%d" % (i + 1) for i in range(len(cols))]) + ")"
+    for name, path in PATHS:
+        best = None
+        for _ in range(args.runs):
+            rows, seconds = run_path(path(dbpg, query, pgq, args.batch_rowcount), curs, ora_query)
+            best = seconds if best is None else min(best, seconds)
+        print('%-30s %-7s %10d rows %8.2fs %10.0f rows/s' % (
+            tab, name, rows, best, rows / best if best else 0.0))
+
+
+def parse_arg():
+    """ parse program options """
+    parser = argparse.ArgumentParser(description="Benchmark pg2ora.py chunks & --use-copy paths")
+    parser.add_argument('--table-list', '-l', dest='tables_to_copy', type=str, required=True,
+                        help='coma separate list of PG tables to read')
+    parser.add_argument('--ora-uri', '-o', dest='ora_uri', default=None,
+                        help='ORA connect string: insert rows to tables of the same name and '
+                             'roll back, default - read & parse PG only')
+    parser.add_argument('--batch-copy-rowcount', '-b', dest='batch_rowcount', type=int,
+                        default=6000, help='rows per batch of copy path, default=%(default)s')
+    parser.add_argument('--runs', dest='runs', type=int, default=3,
+                        help='runs of each path, the best is shown, default=%(default)s')
+    parser.add_argument(dest='pg_uri', help='PG connect string, pq://...')
+    args = parser.parse_args()
+    args.tables_to_copy = tabs2list(args.tables_to_copy)
+    return args
+
+
+def main(args):
+    """ main """
+    dbpg = postgresql.open(args.pg_uri)
+    curs = None
+    if args.ora_uri:
+        curs = cx_Oracle.connect(args.ora_uri).cursor()
+        # both paths bind with the session formats of --use-copy
+        ora_copy_session(curs)
+    for tab in args.tables_to_copy:
+        bench_table(dbpg, curs, tab, args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(parse_arg()))
@@ -11,8 +11,19 @@ import sys
 import os
 import os.path
 import re
+import json
+import hashlib
+import logging
 from argparse import ArgumentParser
 import cx_Oracle
+from profiling import add_profile_args, profiled
+
+MANIFEST_FILE = '.gen_pg_tabs.json'
+MANIFEST_OPTIONS = ('pkeys_in_tab', 'fkeys_in_tab', 'export_tabs', 'export_inds',
+                    'export_seqs', 'seq_start_with_lastnum', 'fk_not_valid')
+APPLY_PLAN_FILE = 'apply_plan.json'
+FK_NOT_VALID_DIR = '4FkNotValid'
+FK_VALIDATE_DIR = '5FkValidate'
 
 
 def ensure_directory(dname):
@@ -92,7 +103,9 @@ ORDER BY uic.index_name, uic.column_position
 def dump_table_indexes(cur, opts, table):
     """returm table indices"""
     indexes_str = ''
-    indexes, idx_uniques = get_indexes_dict(cur, table, not opts.pkeys_in_tab)
+    # PK index is dumped for ALTER TABLE ... USING INDEX, PK of partitioned table builds own
+    get_pk = not opts.pkeys_in_tab and get_partitioning_dict(cur, table) is None
+    indexes, idx_uniques = get_indexes_dict(cur, table, get_pk)
     if indexes:
         idxs = [idx for idx in indexes.keys()]
         idxs.sort()
@@ -135,9 +148,31 @@ order by POSITION
         return None
 
 
+def missing_partition_columns(pk, part):
+    """ partition key columns missing in primary key, PK of PG partitioned table needs them
+        >>> missing_partition_columns({'pk_columns': ['ID', 'SALE_DATE']}, {'columns': ['SALE_DATE']})
+        []
+        >>> missing_partition_columns({'pk_columns': ['ID']}, {'columns': ['REGION', 'SALE_DATE']})
+        ['REGION', 'SALE_DATE']
+    """
+    return [col for col in part['columns'] if col not in pk['pk_columns']]
+
+
+def partitioned_pk_fits(pk, part):
+    """ False with warning when PK can't be created on PG partitioned table """
+    missing = missing_partition_columns(pk, part)
+    if missing:
+        sys.stderr.write('%s: primary key %s is skipped, it lacks partition key columns %s\n' % (
+            pk['table'], pk['constraint_name'], ', '.join(missing)))
+    return not missing
+
+
 def get_primary_key_ddl(cur, table):
     """ information about primary key columns """
     pk = get_primary_key_dict(cur, table)
+    part = get_partitioning_dict(cur, table) if pk else None
+    if part and not partitioned_pk_fits(pk, part):
+        return None
 
     if pk:
         return 'CONSTRAINT %s PRIMARY KEY (%s)' % (pk['constraint_name'], ', '.join(pk['pk_columns']))
@@ -200,21 +235,36 @@ def get_foreign_key_ddl(cur, table):
 
 
 def dump_foreign_keys(cur, opts, table):
-    """ saves constraints """
+    """ saves constraints, for apply plan as NOT VALID and separate VALIDATE """
     fk_columns = get_foreign_key_ddl(cur, table)
     for fkc in fk_columns:
-        ddl = "ALTER TABLE %s ADD %s;" % (table, fkc[1])
-        dump_to_file(opts, '2Constr', table + '.' + fkc[0], ddl)
+        if opts.fk_not_valid:
+            ddl = "ALTER TABLE %s ADD %s NOT VALID;" % (table, fkc[1].rstrip())
+            dump_to_file(opts, FK_NOT_VALID_DIR, table + '.' + fkc[0], ddl)
+            ddl = "ALTER TABLE %s VALIDATE CONSTRAINT %s;" % (table, fkc[0])
+            dump_to_file(opts, FK_VALIDATE_DIR, table + '.' + fkc[0], ddl)
+        else:
+            ddl = "ALTER TABLE %s ADD %s;" % (table, fkc[1])
+            dump_to_file(opts, '2Constr', table + '.' + fkc[0], ddl)
 
 
 def dump_primary_keys(cur, opts, table):
-    """ saves pk constraints """
+    """ saves pk constraints, partitioned table gets PK with own index (no USING INDEX) """
     pk = get_primary_key_dict(cur, table)
-    if pk:
+    if not pk:
+        return
+    part = get_partitioning_dict(cur, table)
+    if part is None:
         ddl = 'ALTER TABLE %s ADD CONSTRAINT %s PRIMARY KEY USING INDEX %s;' % (
             pk['table'], pk['constraint_name'], pk['index_name']
         )
-        dump_to_file(opts, '2Constr', table + '.' + pk['constraint_name'], ddl)
+    elif partitioned_pk_fits(pk, part):
+        ddl = 'ALTER TABLE %s ADD CONSTRAINT %s PRIMARY KEY (%s);' % (
+            pk['table'], pk['constraint_name'], ', '.join(pk['pk_columns'])
+        )
+    else:
+        return
+    dump_to_file(opts, '2Constr', table + '.' + pk['constraint_name'], ddl)
 
 
 def map_pg_number(length: str) -> str:
@@ -288,6 +338,82 @@ def table_info_row(row):
             'nullable': nullable_str, 'default': default_str}
 
 
+def pg_partition_name(table, partition):
+    """ name of PG partition table for oracle table partition
+        >>> pg_partition_name('SALES', 'P2019')
+        'SALES_P2019'
+    """
+    return ('%s_%s' % (table, partition)).upper()
+
+
+def ora_high_value2pg(high_value):
+    """ transforms oracle partition high_value to PG partition bound
+        >>> ora_high_value2pg("TO_DATE(' 2019-01-01 00:00:00', 'SYYYY-MM-DD HH24:MI:SS', 'NLS_CALENDAR=GREGORIAN')")
+        "'2019-01-01 00:00:00'"
+        >>> ora_high_value2pg("TIMESTAMP' 2019-01-01 00:00:00', 100")
+        "'2019-01-01 00:00:00', 100"
+    """
+    high_value = re.sub(r"TO_DATE\('\s*([^']*)'(?:\s*,\s*'[^']*')*\)", r"'\1'", high_value)
+    high_value = re.sub(r"TIMESTAMP\s*'\s*([^']*)'", r"'\1'", high_value)
+    return high_value
+
+
+def get_partitioning_dict(cur, table):
+    """ information about table partitioning """
+    part_type_qry = """SELECT upt.partitioning_type, upkc.column_name
+FROM user_part_tables upt, user_part_key_columns upkc
+WHERE upt.table_name = upkc.name
+AND upkc.object_type = 'TABLE'
+AND upt.table_name=:table_name
+ORDER BY upkc.column_position
+"""
+    part_qry = """SELECT partition_name, high_value
+FROM user_tab_partitions
+WHERE table_name=:table_name
+ORDER BY partition_position
+"""
+    part_type = None
+    part_columns = []
+    for row in select_qry(cur, part_type_qry, {"table_name": table}):
+        part_type = row[0]
+        part_columns.append(row[1].upper())
+
+    if part_type not in ('RANGE', 'LIST', 'HASH'):
+        return None
+
+    return {
+        'type': part_type,
+        'columns': part_columns,
+        'partitions': select_qry(cur, part_qry, {"table_name": table})
+    }
+
+
+def create_partitions_ddl(cur, table):
+    """ PARTITION BY clause and partitions DDL for partitioned table """
+    part = get_partitioning_dict(cur, table)
+    if not part:
+        return None, []
+
+    partition_by = 'PARTITION BY %s (%s)' % (part['type'], ', '.join(part['columns']))
+    partitions_ddl = []
+    lower_bound = ', '.join(['MINVALUE'] * len(part['columns']))
+    for remainder, (partition, high_value) in enumerate(part['partitions']):
+        if part['type'] == 'RANGE':
+            upper_bound = ora_high_value2pg(high_value)
+            bound = 'FOR VALUES FROM (%s) TO (%s)' % (lower_bound, upper_bound)
+            lower_bound = upper_bound
+        elif part['type'] == 'LIST':
+            if high_value.strip().upper() == 'DEFAULT':
+                bound = 'DEFAULT'
+            else:
+                bound = 'FOR VALUES IN (%s)' % ora_high_value2pg(high_value)
+        else:
+            bound = 'FOR VALUES WITH (MODULUS %d, REMAINDER %d)' % (len(part['partitions']), remainder)
+        partitions_ddl.append('CREATE TABLE %s PARTITION OF %s %s;' % (
+            pg_partition_name(table, partition), table.upper(), bound))
+    return partition_by, partitions_ddl
+
+
 def create_create_table_ddl(cur, table, add_pk_cols, add_fk_cols):
     """creates DDL with CREATE TABLE for table"""
     table_cols_qry = """SELECT column_name, data_type, nullable,
@@ -319,8 +445,12 @@ ORDER BY column_name
 
     # creates DDL CREATE TABLE instruction
     # \n, is required when column has comment
-    create_tab_ddl = 'CREATE TABLE %s (\n    %s\n);' % (table.upper(), ',\n    '.join(tab_cols))
-    return create_tab_ddl
+    create_tab_ddl = 'CREATE TABLE %s (\n    %s\n)' % (table.upper(), ',\n    '.join(tab_cols))
+
+    partition_by, partitions_ddl = create_partitions_ddl(cur, table)
+    if partition_by:
+        create_tab_ddl += ' ' + partition_by
+    return '\n'.join([create_tab_ddl + ';'] + partitions_ddl)
 
 
 def create_tab_col_comment_ddl(cur, table):
@@ -358,10 +488,122 @@ def dump_to_file(opts, obj_dir, obj_name, data):
     filename = os.path.join(opts.dest_dir, obj_dir, obj_name + '.sql')
     if opts.verbose:
         print("\n%s:\n%s" % (filename, data))
+    if data[-1] != '\n':
+        data += '\n'
+    relname = os.path.join(obj_dir, obj_name + '.sql')
+    data_hash = hashlib.sha256(data.encode('utf-8')).hexdigest()
+    opts.dumped.append((relname, data_hash))
+    if opts.old_files.get(relname) == data_hash and os.path.exists(filename):
+        return
     with open(filename, 'w') as file:
         file.write(data)
-        if data[-1] != '\n':
-            file.write('\n')
+
+
+def get_objects_ddl_time(cur):
+    """ last_ddl_time of tables (with their indexes) and sequences """
+    ddl_time_qry = """SELECT object_type, object_name, last_ddl_time
+FROM user_objects
+WHERE object_type IN ('TABLE', 'SEQUENCE')
+UNION ALL
+SELECT 'TABLE', ui.table_name, uo.last_ddl_time
+FROM user_indexes ui, user_objects uo
+WHERE uo.object_name = ui.index_name
+AND uo.object_type = 'INDEX'
+"""
+    ddl_times = {}
+    for obj_type, obj_name, last_ddl_time in select_qry(cur, ddl_time_qry, {}):
+        key = obj_type + ':' + obj_name.upper()
+        ddl_times[key] = max(ddl_times.get(key, last_ddl_time), last_ddl_time)
+    return {key: ddl_time.isoformat() for key, ddl_time in ddl_times.items()}
+
+
+def load_manifest(cur, opts):
+    """ reads manifest of previous export, old objects are ignored if options differ """
+    opts.ddl_times = get_objects_ddl_time(cur)
+    opts.options = {opt: getattr(opts, opt) for opt in MANIFEST_OPTIONS}
+    opts.objects = {}
+    opts.old_objects = {}
+    opts.dumped = []
+    opts.changes = {'new': [], 'changed': [], 'dropped': [], 'unchanged': 0}
+
+    filename = os.path.join(opts.dest_dir, MANIFEST_FILE)
+    if os.path.exists(filename):
+        with open(filename) as file:
+            manifest = json.load(file)
+        if manifest['options'] == opts.options:
+            opts.old_objects = manifest['objects']
+    opts.old_files = {relname: data_hash for obj in opts.old_objects.values()
+                      for relname, data_hash in obj['files'].items()}
+
+
+def save_manifest(opts):
+    """ saves objects last_ddl_time and files content hash """
+    ensure_directory(opts.dest_dir)
+    objects = dict(opts.old_objects)
+    objects.update(opts.objects)
+    for key in opts.changes['dropped']:
+        del objects[key]
+    with open(os.path.join(opts.dest_dir, MANIFEST_FILE), 'w') as file:
+        json.dump({'options': opts.options, 'objects': objects}, file, indent=1, sort_keys=True)
+
+
+def is_unchanged(opts, key):
+    """ object has the same last_ddl_time as in manifest and all its files exist """
+    old = opts.old_objects.get(key)
+    return opts.incremental and old is not None \
+        and old['last_ddl_time'] == opts.ddl_times.get(key) \
+        and all(os.path.exists(os.path.join(opts.dest_dir, relname)) for relname in old['files'])
+
+
+def remove_files(opts, relnames):
+    """ removes files of dropped objects """
+    for relname in relnames:
+        filename = os.path.join(opts.dest_dir, relname)
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+def track_object(opts, key, start):
+    """ registers files dumped since start for object """
+    files = dict(opts.dumped[start:])
+    old = opts.old_objects.get(key)
+    if old is None:
+        opts.changes['new'].append(key)
+    elif old['files'] != files:
+        opts.changes['changed'].append(key)
+        if opts.incremental:
+            remove_files(opts, set(old['files']) - set(files))
+    else:
+        opts.changes['unchanged'] += 1
+    opts.objects[key] = {'last_ddl_time': opts.ddl_times.get(key), 'files': files}
+
+
+def keep_object(opts, key):
+    """ object is not changed since previous export """
+    opts.objects[key] = opts.old_objects[key]
+    opts.changes['unchanged'] += 1
+
+
+def drop_missing_objects(opts, obj_type, seen, object_list):
+    """ removes files of objects dropped in oracle """
+    if not opts.incremental:
+        return
+    for key, old in opts.old_objects.items():
+        obj_name = key.split(':', 1)[1]
+        if key.startswith(obj_type + ':') and key not in seen \
+                and (object_list is None or obj_name in object_list):
+            remove_files(opts, old['files'])
+            opts.changes['dropped'].append(key)
+
+
+def print_changes(opts):
+    """ incremental export report """
+    for change in ('new', 'changed', 'dropped'):
+        for key in opts.changes[change]:
+            print('%-8s %s' % (change, key))
+    print('new: %d, changed: %d, dropped: %d, unchanged: %d' % (
+        len(opts.changes['new']), len(opts.changes['changed']),
+        len(opts.changes['dropped']), opts.changes['unchanged']))
 
 
 def dump_sequences(cur, object_list, opts):
@@ -372,9 +614,13 @@ def dump_sequences(cur, object_list, opts):
                  FROM user_sequences"""
     rows = select_qry(cur, seq_qry, {})
 
+    seen = set()
     for row in rows:
         sequence_name = row[0].upper()
         if object_list is None or sequence_name in object_list:
+            key = 'SEQUENCE:' + sequence_name
+            seen.add(key)
+            start = len(opts.dumped)
             if row[1] == 1:
                 min_value = 'NO MINVALUE'
             else:
@@ -405,6 +651,8 @@ def dump_sequences(cur, object_list, opts):
                            (sequence_name, min_value, max_value, increment_by,
                             startswith_number, cache_size, cycle_flag)
             dump_to_file(opts, '3Seq', sequence_name, sequence_ddl)
+            track_object(opts, key, start)
+    drop_missing_objects(opts, 'SEQUENCE', seen, object_list)
 
 
 def dump_tables_indexes(cur, object_list: list, opts: str):
@@ -418,9 +666,17 @@ AND NOT table_name IN (SELECT mview_name FROM user_mviews)
 ORDER BY table_name
 """
     table_list = select_qry(cur, qry_str, {})
+    seen = set()
     for row in table_list:
         table_name = row[0].upper()
         if object_list is None or table_name in object_list:
+            key = 'TABLE:' + table_name
+            seen.add(key)
+            if is_unchanged(opts, key):
+                keep_object(opts, key)
+                continue
+            start = len(opts.dumped)
+
             if opts.export_tabs:
                 table_ddl = create_create_table_ddl(cur, table_name, opts.pkeys_in_tab, opts.fkeys_in_tab)
                 table_comments_ddl = create_tab_comment_ddl(cur, table_name)
@@ -437,14 +693,102 @@ ORDER BY table_name
             if not opts.pkeys_in_tab:
                 dump_primary_keys(cur, opts, table_name)
 
+            track_object(opts, key, start)
+    drop_missing_objects(opts, 'TABLE', seen, object_list)
+
+
+def get_segment_bytes(cur):
+    """ {TABLE or INDEX name: bytes} of oracle segments, partitions summed """
+    segments_qry = """SELECT segment_name, SUM(bytes)
+FROM user_segments
+WHERE segment_type LIKE 'TABLE%' OR segment_type LIKE 'INDEX%'
+GROUP BY segment_name
+"""
+    return {name.upper(): size for name, size in select_qry(cur, segments_qry, {})}
+
+
+def balance_streams(items, streams):
+    """ distribute (name, size) items to streams with the smallest total size, largest first
+        >>> balance_streams([('a', 10), ('b', 7), ('c', 5), ('d', 4), ('e', 1)], 2)
+        [['a', 'd'], ['b', 'c', 'e']]
+        >>> balance_streams([('a', 1)], 3)
+        [['a']]
+    """
+    totals = [0] * streams
+    result = [[] for _ in range(streams)]
+    for name, size in sorted(items, key=lambda item: -item[1]):
+        stream = totals.index(min(totals))
+        totals[stream] += size
+        result[stream].append(name)
+    return [stream for stream in result if stream]
+
+
+def plan_file_object(relname):
+    """ table (index, constraint) name of dumped file
+        >>> plan_file_object('1Tind/SALES.SALES_DATE_IDX.sql')
+        ('SALES', 'SALES_DATE_IDX')
+    """
+    name = os.path.basename(relname)[:-len('.sql')]
+    table, _, obj = name.partition('.')
+    return table, obj
+
+
+def create_apply_plan(cur, opts):
+    """ phases of apply plan: tables & sequences, indexes by opts.apply_streams balanced
+        streams, PKs, FKs NOT VALID, VALIDATE balanced by table size """
+    segment_bytes = get_segment_bytes(cur)
+    files = {}
+    for obj in opts.objects.values():
+        for relname in obj['files']:
+            files.setdefault(relname.split(os.sep, 1)[0], []).append(relname)
+    files = {obj_dir: sorted(relnames) for obj_dir, relnames in files.items()}
+
+    def by_size(obj_dir, size_of):
+        return balance_streams([(relname, segment_bytes.get(size_of(relname), 0))
+                                for relname in files.get(obj_dir, [])], opts.apply_streams)
+
+    index_streams = by_size('1Tind', lambda relname: plan_file_object(relname)[1])
+    table_streams = by_size('1Tab', lambda relname: plan_file_object(relname)[0])
+    validate_tables = balance_streams(
+        [(table, segment_bytes.get(table, 0))
+         for table in set(plan_file_object(relname)[0] for relname in files.get(FK_VALIDATE_DIR, []))],
+        opts.apply_streams)
+    validate_streams = [[relname for relname in files[FK_VALIDATE_DIR]
+                         if plan_file_object(relname)[0] in tables] for tables in validate_tables]
+    phases = [
+        ('tables', table_streams + [files.get('3Seq', [])]),
+        ('indexes', index_streams),
+        ('primary keys', [files.get('2Constr', [])]),
+        ('foreign keys', [files.get(FK_NOT_VALID_DIR, [])]),
+        ('validate', validate_streams),
+    ]
+    return [{'phase': phase, 'streams': [stream for stream in streams if stream]}
+            for phase, streams in phases]
+
+
+def dump_apply_plan(cur, opts):
+    """ saves apply plan for apply_pg_plan.py """
+    plan = create_apply_plan(cur, opts)
+    with open(os.path.join(opts.dest_dir, APPLY_PLAN_FILE), 'w') as file:
+        json.dump({'phases': plan}, file, indent=1)
+    for phase in plan:
+        print('%-12s %s' % (phase['phase'], ', '.join(
+            [str(len(stream)) for stream in phase['streams']]) or '-'))
+
 
 def dump_db_info(cur, stdout, object_list, opts):
     """ dump oracle schema to pg """
+    load_manifest(cur, opts)
     if opts.export_tabs or opts.export_inds:
         dump_tables_indexes(cur, object_list, opts)
 
     if opts.export_seqs:
         dump_sequences(cur, object_list, opts)
+    save_manifest(opts)
+    if opts.apply_streams:
+        dump_apply_plan(cur, opts)
+    if opts.incremental:
+        print_changes(opts)
 
 
 def parse_prog_opts():
@@ -470,9 +814,24 @@ def parse_prog_opts():
     parser.add_argument("-m", "--sequence-strart-last-number", action="store_true",
                         dest="seq_start_with_lastnum",
                         help="Use sequence last_number for start value")
+    parser.add_argument("--incremental", action="store_true", dest="incremental",
+                        help="regenerate only objects with last_ddl_time changed since previous "
+                             "export to DEST_DIR, remove files of dropped objects")
+    parser.add_argument("-a", "--apply-plan", type=int, default=0, dest="apply_streams",
+                        help="write DEST_DIR/%s for apply_pg_plan.py with indexes and FK "
+                             "validation split into APPLY_STREAMS parallel sessions, FKs are "
+                             "written as NOT VALID to %s and VALIDATE to %s, -f is ignored"
+                             % (APPLY_PLAN_FILE, FK_NOT_VALID_DIR, FK_VALIDATE_DIR))
+    add_profile_args(parser)
     parser.add_argument("connect_string", help="ORACLE connect string as for SQL Plus")
 
     opts = parser.parse_args()
+    if opts.apply_streams and opts.fkeys_in_tab:
+        # tables are created in parallel before primary keys, inline REFERENCES would fail
+        sys.stderr.write('-f is ignored with -a: foreign keys are applied after tables '
+                         'and primary keys as NOT VALID\n')
+        opts.fkeys_in_tab = False
+    opts.fk_not_valid = bool(opts.apply_streams)
 
     if opts.object_list is not None:
         opts.object_list = [obj.upper() for obj in opts.object_list.split(',')]
@@ -492,6 +851,9 @@ def main():
     """main func"""
     opts = parse_prog_opts()
     stdout = sys.stdout
+    if opts.profile_dir:
+        # profile summary goes to stderr
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
 
     ora_conn = init_db_conn(opts.connect_string)
     if not ora_conn:
@@ -499,7 +861,8 @@ def main():
         return 1
     ora_cur = ora_conn.cursor()
     init_session(ora_cur)
-    dump_db_info(ora_cur, stdout, opts.object_list, opts)
+    with profiled(opts, 'gen_pg_tabs'):
+        dump_db_info(ora_cur, stdout, opts.object_list, opts)
     ora_cur.close()
 
 
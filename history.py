@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""
+    per table results of ora2pg.py runs in local SQLite database,
+    --auto-tune of batch size, processes & table order, history report
+"""
+
+import os
+import sqlite3
+import datetime
+import logging
+from collections import OrderedDict
+
+LOGGER = logging.getLogger(__name__)
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    started TEXT,
+    command TEXT
+);
+CREATE TABLE IF NOT EXISTS table_results (
+    run_id INTEGER,
+    tab TEXT,
+    finished TEXT,
+    rows INTEGER,
+    bytes INTEGER,
+    seconds REAL,
+    mode TEXT,
+    batch_rowcount INTEGER,
+    processes INTEGER,
+    errors INTEGER
+);
+CREATE INDEX IF NOT EXISTS table_results_tab ON table_results (tab, run_id);
+"""
+MIN_BATCH_ROWCOUNT = 500
+MAX_BATCH_ROWCOUNT = 100000
+
+
+def add_history_args(parser):
+    """ add history options to argument parser """
+    parser.add_argument('--history-db', dest='history_db', default='ora2pg_history.db',
+                        help='SQLite database of per table results, empty - do not record, '
+                             'default=%(default)s')
+    parser.add_argument('--auto-tune', dest='auto_tune', action='store_true',
+                        help='pick batch size per table, --processes and table order '
+                             'from results of previous runs in --history-db')
+
+
+def open_history(filename):
+    """ connection to history database, schema created if missing """
+    dbh = sqlite3.connect(filename, timeout=60)
+    dbh.executescript(HISTORY_SCHEMA)
+    return dbh
+
+
+def start_run(args, command) -> int or None:
+    """ register run, returns run_id for record_table """
+    if not args.history_db:
+        return None
+    dbh = open_history(args.history_db)
+    with dbh:
+        run_id = dbh.execute("insert into runs (started, command) values (?, ?)",
+                             (datetime.datetime.now().isoformat(), command)).lastrowid
+    dbh.close()
+    return run_id
+
+
+def run_mode(args) -> str:
+    """
+        copy mode of table results
+        >>> import argparse
+        >>> run_mode(argparse.Namespace(use_copy=True, fast_load=False, columnar=True, ora_format=False))
+        'copy+columnar'
+    """
+    mode = 'copy' if args.use_copy else 'insert'
+    for flag in ('fast_load', 'columnar', 'ora_format'):
+        if getattr(args, flag, False):
+            mode += '+' + flag.replace('_', '-')
+    return mode
+
+
+def record_table(args, tab, rows, nbytes, seconds, errors):
+    """ append table (partition) result of the run """
+    if getattr(args, 'run_id', None) is None:
+        return
+    dbh = open_history(args.history_db)
+    with dbh:
+        dbh.execute("insert into table_results values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (args.run_id, tab, datetime.datetime.now().isoformat(), rows, nbytes,
+                     seconds, run_mode(args), args.batch_rowcount, args.processes, errors))
+    dbh.close()
+
+
+def hill_climb(tried, current, larger, smaller) -> int:
+    """
+        next value to try: best rate so far, or its neighbour beyond the tried range
+        >>> hill_climb({}, 6000, 12000, 3000)
+        6000
+        >>> hill_climb({6000: 10.0}, 6000, 12000, 3000)
+        12000
+        >>> hill_climb({6000: 10.0, 12000: 8.0}, 6000, 12000, 3000)
+        3000
+        >>> hill_climb({3000: 9.0, 6000: 10.0, 12000: 8.0}, 6000, 12000, 3000)
+        6000
+    """
+    if not tried:
+        return current
+    if larger is not None and current == max(tried) and larger not in tried:
+        return larger
+    if smaller is not None and current == min(tried) and smaller not in tried:
+        return smaller
+    return current
+
+
+def best_value(tried, default):
+    """ value with the best rate """
+    if not tried:
+        return default
+    return max(tried, key=tried.get)
+
+
+def auto_tune(args, tables) -> list:
+    """
+        set args.processes & args.batch_sizes from previous results of the same mode,
+        returns tables, the longest first
+    """
+    if not args.history_db or not os.path.exists(args.history_db):
+        return tables
+    dbh = open_history(args.history_db)
+    mode = run_mode(args)
+    by_processes = {}
+    for processes, rate in dbh.execute(
+            "select processes, sum(rows) / sum(seconds) from table_results "
+            "where mode = ? and errors = 0 and seconds > 0 group by processes", (mode,)):
+        by_processes[processes] = rate
+    processes = best_value(by_processes, args.processes)
+    args.processes = hill_climb(by_processes, processes,
+                                processes + 1 if processes < os.cpu_count() else None,
+                                processes - 1 if processes > 1 else None)
+
+    batches = {}
+    for tab, batch_rowcount, rate in dbh.execute(
+            "select tab, batch_rowcount, sum(rows) / sum(seconds) from table_results "
+            "where mode = ? and errors = 0 and seconds > 0 group by tab, batch_rowcount", (mode,)):
+        batches.setdefault(tab, {})[batch_rowcount] = rate
+    for tab, tried in batches.items():
+        batch = best_value(tried, args.batch_rowcount)
+        args.batch_sizes[tab] = hill_climb(
+            tried, batch,
+            batch * 2 if batch * 2 <= MAX_BATCH_ROWCOUNT else None,
+            batch // 2 if batch // 2 >= MIN_BATCH_ROWCOUNT else None)
+
+    seconds = {}
+    for tab, tab_seconds in dbh.execute(
+            "select tab, seconds from table_results r "
+            "where run_id = (select max(run_id) from table_results where tab = r.tab)"):
+        # partitions of the last run summed up
+        seconds[tab.split(':')[0]] = seconds.get(tab.split(':')[0], 0) + tab_seconds
+    dbh.close()
+    LOGGER.info('auto tune: processes=%d, batch sizes=%s', args.processes, args.batch_sizes)
+    print('auto tune: processes=%d, %d tables with own batch size' % (
+        args.processes, len(args.batch_sizes)))
+    return sorted(tables, key=lambda tab: -seconds.get(tab, 0))
+
+
+def trend(rates) -> str:
+    """
+        last rate against average of previous ones
+        >>> trend([100.0, 100.0, 120.0])
+        '+20%'
+        >>> trend([100.0])
+        ''
+    """
+    if len(rates) < 2:
+        return ''
+    previous = sum(rates[:-1]) / (len(rates) - 1)
+    return '%+.0f%%' % ((rates[-1] / previous - 1) * 100) if previous else ''
+
+
+def history_report(args):
+    """ last runs per table: rows, time, rates, mode and trend of rows/s """
+    dbh = open_history(args.history_db)
+    query = "select tab, finished, rows, bytes, seconds, mode, batch_rowcount, processes, " \
+            "errors from table_results order by tab, run_id, finished"
+    results = OrderedDict()
+    for row in dbh.execute(query):
+        if args.tables_to_copy is None or row[0].split(':')[0] in args.tables_to_copy:
+            results.setdefault(row[0], []).append(row)
+    dbh.close()
+
+    print('%-30s %-19s %12s %8s %10s %8s %-20s %7s %4s %6s %s' % (
+        'table', 'finished', 'rows', 'sec', 'rows/s', 'MB/s', 'mode', 'batch', 'proc',
+        'errors', 'trend'))
+    for tab, rows in results.items():
+        rows = rows[-args.runs:]
+        rates = []
+        for _, finished, nrows, nbytes, seconds, mode, batch, processes, errors in rows:
+            rates.append(nrows / seconds if seconds else 0.0)
+            print('%-30s %-19s %12d %8.1f %10.0f %8.2f %-20s %7d %4d %6d %s' % (
+                tab, finished[:19], nrows, seconds, rates[-1],
+                nbytes / 1024 / 1024 / seconds if seconds else 0.0,
+                mode, batch, processes, errors, trend(rates)))
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""
+    logging for ora2pg.py, pg2ora.py: records are put to a queue by copying
+    processes & threads and written by a listener thread to size rotated file,
+    row errors over the per table limit are only counted
+"""
+
+import os
+import atexit
+import logging
+import threading
+import logging.handlers
+import multiprocessing
+from collections import OrderedDict
+
+LOGGER = logging.getLogger(__name__)
+
+LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name) -30s %(funcName) '
+              '-35s %(lineno) -5d: %(message)s')
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+
+def add_log_args(parser, log_file):
+    """ add logging options to argument parser """
+    parser.add_argument('--log-file', default=log_file, dest='log_file',
+                        help='log file, default=%(default)s')
+    parser.add_argument('--log-level', dest='log_level', choices=LOG_LEVELS, default='INFO',
+                        help='log level, DEBUG logs every query, default=%(default)s')
+    parser.add_argument('--log-max-mb', dest='log_max_mb', type=float, default=100,
+                        help='rotate log file when it exceeds this size, default=%(default)s')
+    parser.add_argument('--log-backups', dest='log_backups', type=int, default=5,
+                        help='number of rotated log files to keep, default=%(default)s')
+    parser.add_argument('--log-table-errors', dest='log_table_errors', type=int, default=20,
+                        help='log only first row errors of each table, the rest are counted '
+                             'and summarized at exit, default=%(default)s')
+
+
+ERROR_COUNT_BATCH = 1000 # suppressed row errors of table sent by one count record
+
+
+class TableErrorLimit(logging.Filter):
+    """
+        on queue handler of each process: passes first limit error records of each table
+        (extra={'table': ...}), drops the rest before they are formatted and queued,
+        their number is sent by count records with 'suppressed' attribute
+    """
+
+    def __init__(self, limit, enqueue):
+        super().__init__()
+        self.limit = limit
+        self.enqueue = enqueue
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ counts of this process, a forked process starts from zero """
+        self.pid = os.getpid()
+        self.errors = {}
+        self.unsent = {}
+
+    def filter(self, record):
+        table = getattr(record, 'table', None)
+        if table is None or record.levelno < logging.ERROR:
+            return True
+        with self.lock:
+            if self.pid != os.getpid():
+                self.reset()
+            self.errors[table] = self.errors.get(table, 0) + 1
+            if self.errors[table] <= self.limit:
+                return True
+            self.unsent[table] = self.unsent.get(table, 0) + 1
+            if self.unsent[table] >= ERROR_COUNT_BATCH:
+                self.send(table)
+        return False
+
+    def send(self, table):
+        """ count record of suppressed errors of table """
+        self.enqueue(logging.makeLogRecord({
+            'name': __name__, 'levelno': logging.DEBUG, 'levelname': 'DEBUG',
+            'msg': 'suppressed row errors', 'table': table, 'suppressed': self.unsent.pop(table)}))
+
+    def flush(self):
+        """ send counts of all tables """
+        with self.lock:
+            if self.pid != os.getpid():
+                self.reset()
+            for table in list(self.unsent):
+                self.send(table)
+
+
+class TableErrorSummary(logging.Filter):
+    """ on file handler: counts logged error records & suppressed ones, drops count records """
+
+    def __init__(self):
+        super().__init__()
+        self.errors = OrderedDict()
+
+    def filter(self, record):
+        table = getattr(record, 'table', None)
+        if table is None:
+            return True
+        logged, suppressed = self.errors.get(table, (0, 0))
+        count = getattr(record, 'suppressed', None)
+        if count is not None:
+            self.errors[table] = (logged, suppressed + count)
+            return False
+        if record.levelno >= logging.ERROR:
+            self.errors[table] = (logged + 1, suppressed)
+        return True
+
+    def summary(self) -> list:
+        """
+            >>> records = []
+            >>> limit, summary = TableErrorLimit(2, records.append), TableErrorSummary()
+            >>> [limit.filter(logging.makeLogRecord({'levelno': logging.ERROR, 'table': 'FOO'}))
+            ...  for _ in range(3)]
+            [True, True, False]
+            >>> limit.flush()
+            >>> [summary.filter(logging.makeLogRecord({'levelno': logging.ERROR, 'table': 'FOO'}))
+            ...  for _ in range(2)] + [summary.filter(record) for record in records]
+            [True, True, False]
+            >>> summary.summary()
+            ['FOO: 3 row errors, 1 not logged']
+        """
+        return ['%s: %d row errors, %d not logged' % (table, logged + suppressed, suppressed)
+                for table, (logged, suppressed) in self.errors.items()]
+
+
+def flush_table_errors():
+    """ send row error counts not sent yet, worker processes call it before they finish """
+    for handler in logging.getLogger().handlers:
+        for log_filter in handler.filters:
+            if isinstance(log_filter, TableErrorLimit):
+                log_filter.flush()
+
+
+def start_logging(args):
+    """
+        route all records through a queue to the file handler of listener thread,
+        forked worker processes put their records to the same queue
+    """
+    log_queue = multiprocessing.Queue(-1)
+    file_handler = logging.handlers.RotatingFileHandler(
+        args.log_file, maxBytes=int(args.log_max_mb * 1024 * 1024),
+        backupCount=args.log_backups)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    error_summary = TableErrorSummary()
+    file_handler.addFilter(error_summary)
+
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # forked processes inherit the handler with the limit and count their own errors
+    queue_handler.addFilter(TableErrorLimit(args.log_table_errors, queue_handler.enqueue))
+    root = logging.getLogger()
+    root.setLevel(args.log_level)
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+    listener.start()
+    atexit.register(stop_logging, listener, queue_handler, error_summary)
+
+
+def stop_logging(listener, queue_handler, error_summary):
+    """ write queued records and row errors summary """
+    flush_table_errors()
+    logging.getLogger().removeHandler(queue_handler)
+    listener.stop()
+    for line in error_summary.summary():
+        print(line)
+        for handler in listener.handlers:
+            handler.handle(logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'funcName': 'stop_logging', 'msg': line}))
+    for handler in listener.handlers:
+        handler.close()
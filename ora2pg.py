@@ -1,16 +1,36 @@
 #!/usr/bin/env python3
 # -*- coding: utf8 -*-import logging
 import sys
+import re
 import logging.handlers
-from collections import namedtuple
+import os
+import time
+import json
+import gzip
+import lzma
+import hashlib
+import zlib
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+from functools import partial
 from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
 import argparse
+import itertools
+import threading
+import queue
 import postgresql # pip install py-postgresql
 import cx_Oracle # pip install cx_Oracle
 from tqdm import trange, tqdm
 
 import datetime
 
+from gen_pg_tabs import pg_partition_name
+from profiling import add_profile_args, new_profile, profile_batch, save_profile
+from logsetup import add_log_args, start_logging, flush_table_errors
+from throttle import add_throttle_args, Throttle
+from history import add_history_args, start_run, record_table, auto_tune, history_report
+
 ########## https://github.com/python-postgres/fe/issues/106 ########
 ########## workaround ##############################################
 import postgresql.versionstring as vs
@@ -21,34 +41,37 @@ vs.split = parse_debian_compat
 
 LOGGER = logging.getLogger(__name__)
 
-def pg_table_fk_list(dbpg, tab):
-    """ list of foreign keys on table """
-    query = "select constraint_name from information_schema.table_constraints " \
+ENCODE_CHUNKSIZE = 512 # rows per task for --processes pool
+SEQ_BLOCK_SIZE = 1000 # sequences altered in one DO / PL/SQL block
+DDL_BLOCK_SIZE = 500 # tables altered (truncated) in one DO / PL/SQL block (statement)
+SMALL_TABLE_LIMIT_FACTOR = 10 # small table with more rows than stats * factor is copied as usual
+LOAD_BLOCK_SIZE = 1024 * 1024 # bytes sent to PG COPY at once by load command
+MANIFEST_FILE = 'manifest.json'
+COMPRESS_EXT = {'gzip': 'gz', 'lzma': 'xz'}
+
+def pg_tables_fk_list(dbpg, tables) -> dict:
+    """ {table: [foreign key, ...]} of tables, one catalog query """
+    query = "select upper(table_name), constraint_name from information_schema.table_constraints " \
             "where constraint_type='FOREIGN KEY' " \
-            "and table_name = $1"
-    LOGGER.debug('%s, tab=%s', query, tab.lower())
-    dbq = dbpg.prepare(query)
-    return [res['constraint_name'] for res in dbq(tab.lower())]
-
-def pg_drop_fk_tab(dbpg, tab):
-    """ drop fk on table """
-    fk_list = pg_table_fk_list(dbpg, tab)
-    for fk in fk_list:
-        query = "alter table %s drop constraint %s" % (tab, fk)
-        LOGGER.debug("%s, table=%s, fk=%s", query, tab, fk)
+            "and table_name = any($1::text[]) order by 1, 2"
+    LOGGER.debug('%s, tables=%d', query, len(tables))
+    fk_lists = OrderedDict()
+    for tab, constraint in dbpg.prepare(query)([tab.lower() for tab in tables]):
+        fk_lists.setdefault(tab, []).append(constraint)
+    return fk_lists
+
+def pg_execute_blocks(dbpg, statements):
+    """ execute statements by DO blocks of DDL_BLOCK_SIZE """
+    for block in chunks(statements, DDL_BLOCK_SIZE):
+        query = "DO $$BEGIN\n" + "\n".join(block) + "\nEND$$"
+        LOGGER.debug(query)
         dbpg.execute(query)
 
-
 def pg_drop_fk(dbpg, table_list):
     """ drop PG FK on table list """
-    for tab in table_list:
-        pg_drop_fk_tab(dbpg, tab)
-
-def pg_disable_triggers_tab(dbpg, tab):
-    """ disable pg trigger """
-    query = "ALTER TABLE " + tab + " DISABLE TRIGGER USER"
-    LOGGER.debug(query)
-    dbpg.execute(query)
+    pg_execute_blocks(dbpg, [
+        "ALTER TABLE %s %s;" % (tab, ', '.join(["DROP CONSTRAINT %s" % fk for fk in fk_list]))
+        for tab, fk_list in pg_tables_fk_list(dbpg, table_list).items()])
 
 def pg_truncate_tab(dbpg, tab):
     """ truncate dest table """
@@ -56,26 +79,266 @@ def pg_truncate_tab(dbpg, tab):
     LOGGER.debug(query)
     dbpg.execute(query)
 
-def pg_enable_trigger_tab(dbpg, tab):
-    """ enable trigger """
-    query = "ALTER TABLE " + tab + " ENABLE TRIGGER USER"
+def pg_set_logged_tab(dbpg, tab, logged):
+    """ switch table between LOGGED and UNLOGGED """
+    query = "ALTER TABLE " + tab + (" SET LOGGED" if logged else " SET UNLOGGED")
     LOGGER.debug(query)
     dbpg.execute(query)
 
+def pg_partitioned_tabs(dbpg, tables) -> dict:
+    """ PG partitioned tables of list: {table: [leaf partitions]} """
+    query = "select upper(p.relname), upper(c.relname) " \
+            "from pg_inherits i join pg_class p on p.oid = i.inhparent " \
+            "join pg_class c on c.oid = i.inhrelid " \
+            "where p.relkind = 'p' and c.relkind = 'r' and pg_table_is_visible(p.oid) " \
+            "and upper(p.relname) = any($1::text[]) order by 1, 2"
+    LOGGER.debug(query)
+    partitions = {}
+    for tab, partition in dbpg.prepare(query)(list(tables)):
+        partitions.setdefault(tab, []).append(partition)
+    return partitions
+
+def fast_load_tabs(tables, pg_partitions) -> list:
+    """
+        tables to switch to UNLOGGED: leaf partitions instead of partitioned tables
+        >>> fast_load_tabs(['SALES', 'CLIENTS'], {'SALES': ['SALES_P1', 'SALES_P2']})
+        ['SALES_P1', 'SALES_P2', 'CLIENTS']
+    """
+    return [part for tab in tables for part in pg_partitions.get(tab, [tab])]
+
+def pg_copy_freeze(target, args) -> str:
+    """ FREEZE option of --fast-load COPY, PG rejects it for partitioned tables """
+    if not args.fast_load:
+        return ""
+    if target in args.pg_partitions:
+        LOGGER.warning('%s: partitioned PG table, COPY without FREEZE', target)
+        return ""
+    return " with (freeze)"
+
+def pg_fast_load_session(dbpg):
+    """ session settings for the initial full load """
+    query = "SET synchronous_commit TO off"
+    LOGGER.debug(query)
+    dbpg.execute(query)
+
+@contextmanager
+def timed_phase(args, phase):
+    """ accumulate time spent in phase """
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        args.phase_times[phase] = args.phase_times.get(phase, 0.0) + time.monotonic() - started
+
+def print_phase_times(args):
+    """ print time spent in each phase """
+    if not args.phase_times:
+        return
+    print('*'*40)
+    for phase, seconds in args.phase_times.items():
+        resstr = "%-20s %10.1fs" % (phase, seconds)
+        LOGGER.info(resstr)
+        print(resstr)
+
 def get_count_rows_tab_cond(tab:str, args) -> str or None:
     if tab in args.replace_query:
         query = args.replace_query[tab].upper()
         return "select count(*) from " + query.split('FROM', 1)[1]
     return None
 
-def ora_count_rows(curs, tab, args) -> int:
-    """ source table rowcount """
+def ora_source(tab, partition=None, scn=None) -> str:
+    """
+        >>> ora_source('SALES', 'P2019')
+        'SALES PARTITION (P2019)'
+        >>> ora_source('SALES', scn=1234)
+        'SALES AS OF SCN 1234'
+    """
+    source = tab if partition is None else "%s PARTITION (%s)" % (tab, partition)
+    if scn is None:
+        return source
+    return "%s AS OF SCN %d" % (source, scn)
+
+ORA_SCN_PLACEHOLDER = re.compile(r'\s+AS\s+OF\s+SCN\s+:scn\b', re.I)
+
+def ora_query_as_of(query, tab, scn) -> str:
+    """
+        flashback replaced query to scn: "AS OF SCN :scn" written after tables in
+        the query, otherwise its only table reference "from [SCHEMA.]TAB [alias]"
+        >>> ora_query_as_of("select * from foo f where bar='bar'", 'FOO', 1234)
+        "select * from foo AS OF SCN 1234 f where bar='bar'"
+        >>> ora_query_as_of("select * from s.foo AS OF SCN :scn join bar AS OF SCN :scn using (id)",
+        ...                 'FOO', 1234)
+        'select * from s.foo AS OF SCN 1234 join bar AS OF SCN 1234 using (id)'
+        >>> ora_query_as_of("select * from foo AS OF SCN :scn", 'FOO', None)
+        'select * from foo'
+        >>> ora_query_as_of("select * from foo join bar using (id)", 'FOO', 1234)
+        ... # doctest: +IGNORE_EXCEPTION_DETAIL
+        Traceback (most recent call last):
+        Exception: FOO: replaced query can not be read AS OF SCN
+    """
+    if ORA_SCN_PLACEHOLDER.search(query):
+        return ORA_SCN_PLACEHOLDER.sub('' if scn is None else ' AS OF SCN %d' % scn, query)
+    if scn is None:
+        return query
+    as_of, matches = re.subn(r'(\bfrom\s+(?:\w+\.)?%s\b)' % re.escape(tab),
+                             r'\1 AS OF SCN %d' % scn, query, flags=re.I)
+    other_tables = len(re.findall(r'\b(?:from|join)\b', query, flags=re.I)) != 1 or \
+        re.search(r'\bfrom\s+\S+(?:\s+(?!where\b)\w+)?\s*,', query, flags=re.I)
+    if matches != 1 or other_tables:
+        raise Exception('%s: replaced query can not be read AS OF SCN %d, write '
+                        '"AS OF SCN :scn" after each table: %s' % (tab, scn, query))
+    return as_of
+
+def ora_select_query(tab, args, partition=None) -> str:
+    """ query to read source table (partition), only PG target columns if known """
+    if tab in args.replace_query:
+        return ora_query_as_of(args.replace_query[tab], tab, args.scn)
+    columns = args.columns.get(tab)
+    select_list = ','.join(['"%s"' % col for col in columns]) if columns else '*'
+    return "select " + select_list + " from " + ora_source(tab, partition, args.scn)
+
+def ora_tabs_columns(curs) -> dict:
+    """ {TABLE: [COLUMN, ...]} of oracle user tables """
+    query = "select table_name, column_name from user_tab_columns " \
+            "order by table_name, column_id"
+    LOGGER.debug("query=%s", query)
+    curs.execute(query)
+    columns = {}
+    for tab, col in curs.fetchall():
+        columns.setdefault(tab, []).append(col)
+    return columns
+
+def pg_tabs_columns(dbpg) -> dict:
+    """ {TABLE: [COLUMN, ...]} of PG tables, only the one found first on search_path by name """
+    query = "select c.relname, a.attname from pg_class c " \
+            "join pg_namespace n on n.oid = c.relnamespace " \
+            "join pg_attribute a on a.attrelid = c.oid " \
+            "where c.relkind in ('r', 'p') and n.nspname = ANY (current_schemas(false)) " \
+            "and pg_table_is_visible(c.oid) and a.attnum > 0 and not a.attisdropped " \
+            "order by c.relname, a.attnum"
+    LOGGER.debug("query=%s", query)
+    columns = {}
+    for tab, col in dbpg.prepare(query)():
+        columns.setdefault(tab.upper(), []).append(col.upper())
+    return columns
+
+def project_columns(ora_cols, pg_cols) -> tuple:
+    """
+        columns to copy, oracle only columns, PG only columns
+        >>> project_columns(['ID', 'OLD_BLOB', 'NAME'], ['ID', 'NAME', 'NEW'])
+        (['ID', 'NAME'], ['OLD_BLOB'], ['NEW'])
+    """
+    return ([col for col in ora_cols if col in pg_cols],
+            [col for col in ora_cols if col not in pg_cols],
+            [col for col in pg_cols if col not in ora_cols])
+
+def plan_columns(curs, dbpg, args) -> list:
+    """
+        select only columns PG target has, report column mismatches before copy,
+        returns tables to copy: without tables having no columns in common
+    """
+    ora_columns = ora_tabs_columns(curs)
+    pg_columns = pg_tabs_columns(dbpg)
+    tables = []
+    for tab in args.tables_to_copy:
+        tables.append(tab)
+        if tab in args.replace_query:
+            continue
+        if tab not in pg_columns:
+            resstr = "%s: no such table in PG" % tab
+            LOGGER.error(resstr)
+            print(resstr)
+            continue
+        columns, ora_only, pg_only = project_columns(ora_columns.get(tab, []), pg_columns[tab])
+        if not columns:
+            resstr = "%s: no columns in common with PG, skipped" % tab
+            LOGGER.error(resstr)
+            print(resstr)
+            tables.pop()
+            continue
+        if ora_only:
+            resstr = "%s: not in PG, skipped: %s" % (tab, ', '.join(ora_only))
+            LOGGER.warning(resstr)
+            print(resstr)
+        if pg_only:
+            resstr = "%s: not in ORA, PG default used: %s" % (tab, ', '.join(pg_only))
+            LOGGER.warning(resstr)
+            print(resstr)
+        args.columns[tab] = columns
+    return tables
+
+def ora_current_scn(curs) -> int:
+    """ current oracle SCN """
+    query = "select current_scn from v$database"
+    LOGGER.debug("query=%s", query)
+    curs.execute(query)
+    return int(curs.fetchone()[0])
+
+def ora_count_rows(curs, tab, args, partition=None) -> int:
+    """ source table (partition) rowcount """
     replaced_query = get_count_rows_tab_cond(tab, args)
-    query = replaced_query if replaced_query else "select count(*) from " + tab
+    if replaced_query:
+        query = ora_query_as_of(replaced_query, tab, args.scn)
+    else:
+        query = "select count(*) from " + ora_source(tab, partition, args.scn)
     LOGGER.debug("query=%s", query)
     curs.execute(query)
     return int(curs.fetchone()[0])
 
+def ora_stat_rows(curs, tab, partition=None) -> int or None:
+    """ source table (partition) rowcount from optimizer statistics """
+    if partition is None:
+        query = "select num_rows from user_tables where table_name = :tab"
+        params = {'tab': tab}
+    else:
+        query = "select num_rows from user_tab_partitions " \
+                "where table_name = :tab and partition_name = :part"
+        params = {'tab': tab, 'part': partition}
+    LOGGER.debug("query=%s, params=%s", query, params)
+    curs.execute(query, params)
+    row = curs.fetchone()
+    return None if row is None or row[0] is None else int(row[0])
+
+BackgroundCount = namedtuple('BackgroundCount', 'thread,dbora,result')
+
+def start_background_count(tab, args, partition=None) -> BackgroundCount:
+    """ exact source rowcount in own ORA session, runs while the table is copied """
+    dbora = cx_Oracle.connect(args.ora_uri, threaded=True)
+    result = {}
+
+    def count():
+        try:
+            result['rows'] = ora_count_rows(dbora.cursor(), tab, args, partition)
+        except cx_Oracle.Error as ex:
+            LOGGER.debug('background count %s: %s', tab, ex)
+        finally:
+            dbora.close()
+
+    thread = threading.Thread(target=count, name='count ' + tab, daemon=True)
+    thread.start()
+    return BackgroundCount(thread, dbora, result)
+
+def show_progress(pbar, rows, args, count=None):
+    """ advance progress bar by fetched batch, show applied throttling limits """
+    if args.throttle.active:
+        pbar.set_postfix_str(args.throttle.postfix(), refresh=False)
+    pbar.update(len(rows))
+    refine_total(pbar, count)
+
+def refine_total(pbar, count):
+    """ replace statistics based progress total by the exact rowcount when it is ready """
+    if count is not None and 'rows' in count.result and pbar.total != count.result['rows']:
+        pbar.total = count.result['rows']
+        pbar.refresh()
+
+def stop_background_count(count):
+    """ copy is done, exact rowcount is not needed any more """
+    if count is not None and count.thread.is_alive():
+        try:
+            count.dbora.cancel()
+        except cx_Oracle.Error:
+            pass
+
 def pg_count_rows(dbpg, tab, args) -> int:
     """ pg table rowcount """
     query = "select count(*) count from " + tab
@@ -83,6 +346,19 @@ def pg_count_rows(dbpg, tab, args) -> int:
     qcount = dbpg.prepare(query)
     return qcount()[0]['count']
 
+def get_ora_partitioned_tabs(curs) -> dict:
+    """ partitioned oracle user tables: {table: (partitioning_type, [partitions])} """
+    query = "select p.table_name, t.partitioning_type, p.partition_name " \
+            "from user_tab_partitions p, user_part_tables t " \
+            "where p.table_name = t.table_name " \
+            "order by p.table_name, p.partition_position"
+    LOGGER.debug("query=%s", query)
+    curs.execute(query)
+    partitioned = {}
+    for tab, part_type, partition in curs.fetchall():
+        partitioned.setdefault(tab, (part_type, []))[1].append(partition)
+    return partitioned
+
 def get_ora_user_tabs(curs):
     """ returns all oracle user tables """
     query = "select table_name from user_tables"
@@ -99,9 +375,241 @@ def escape(data):
     return ''.join([ch if ch not in ['\b', '\f', '\n', '\r', '\t', '\v', '\\']
                     else '\\'+ch for ch in data])
 
-def escape_row(ora_row):
+COPY_ESCAPE = str.maketrans({ch: '\\' + ch for ch in '\b\f\n\r\t\v\\'})
+
+def copy_plain(data):
+    """ NUMBER, DATE: str() never needs escaping """
+    return '\\N' if data is None else str(data)
+
+def copy_text(data):
+    """
+        VARCHAR2, CHAR
+        >>> copy_text('a\\tb\\\\c')
+        'a\\\\\\tb\\\\\\\\c'
+    """
+    return '\\N' if data is None else data.translate(COPY_ESCAPE)
+
+def insert_bin(data):
+    """ --binary-col column for INSERT, RAW bytes are passed as is """
+    return data.encode('cp866') if data and isinstance(data, str) else data
+
+def copy_bytea(data):
+    """
+        RAW, BLOB: bytea hex format, its backslash escaped for COPY text
+        >>> print(copy_bytea(b'\\x01\\xff'))
+        \\\\x01ff
+    """
+    return '\\N' if data is None else '\\\\x' + data.hex()
+
+def copy_bin_text(data):
+    """ --binary-col VARCHAR2 column for COPY: bytea of cp866 encoded text """
+    return copy_bytea(insert_bin(data))
+
+BINARY_TYPES = (cx_Oracle.BINARY, cx_Oracle.BLOB, cx_Oracle.LONG_BINARY)
+
+def binary_columns(description) -> list:
+    """
+        RAW & BLOB columns loaded to bytea
+        >>> binary_columns([('ID', cx_Oracle.NUMBER), ('DATA', cx_Oracle.BINARY)])
+        ['DATA']
+    """
+    return [col[0] for col in description if col[1] in BINARY_TYPES]
+
+COPY_CODECS = {
+    cx_Oracle.NUMBER: copy_plain,
+    cx_Oracle.NATIVE_FLOAT: copy_plain,
+    cx_Oracle.NATIVE_INT: copy_plain,
+    cx_Oracle.DATETIME: copy_plain,
+    cx_Oracle.TIMESTAMP: copy_plain,
+    cx_Oracle.STRING: copy_text,
+    cx_Oracle.FIXED_CHAR: copy_text,
+    cx_Oracle.NCHAR: copy_text,
+    cx_Oracle.FIXED_NCHAR: copy_text,
+    cx_Oracle.BINARY: copy_bytea,
+    cx_Oracle.BLOB: copy_bytea,
+    cx_Oracle.LONG_BINARY: copy_bytea,
+}
+
+def encode_copy_row(codecs, ora_row):
     """ escape ora row for PG COPY """
-    return ('\t'.join([escape(i) for i in ora_row]) + '\n').encode('utf-8')
+    return ('\t'.join([codec(data) for codec, data in zip(codecs, ora_row)]) + '\n').encode('utf-8')
+
+def encode_insert_row(codecs, ora_row):
+    """
+        >>> encode_insert_row((None, None, None, insert_bin), ('1', '2', '4', '\x01'))
+        ('1', '2', '4', b'\\x01')
+    """
+    return tuple([data if codec is None else codec(data) for codec, data in zip(codecs, ora_row)])
+
+COLUMNAR_TYPES = (cx_Oracle.NUMBER, cx_Oracle.DATETIME) # fetched as text by --columnar
+
+def ora_copy_session(curs):
+    """ NLS formats of oracle NUMBER, DATE, TIMESTAMP text understood by PG COPY """
+    for query in ("ALTER SESSION SET NLS_NUMERIC_CHARACTERS = '.,'",
+                  "ALTER SESSION SET NLS_DATE_FORMAT = 'YYYY-MM-DD HH24:MI:SS'",
+                  "ALTER SESSION SET NLS_TIMESTAMP_FORMAT = 'YYYY-MM-DD HH24:MI:SS.FF'",
+                  "ALTER SESSION SET NLS_TIMESTAMP_TZ_FORMAT = 'YYYY-MM-DD HH24:MI:SS.FFTZH:TZM'"):
+        LOGGER.debug(query)
+        curs.execute(query)
+
+def blob_output_type_handler(cursor, name, default_type, size, precision, scale):
+    """ BLOB is fetched as bytes in fetch arrays instead of LOB locator read one by one """
+    if default_type == cx_Oracle.BLOB:
+        return cursor.var(cx_Oracle.LONG_BINARY, arraysize=cursor.arraysize)
+    return None
+
+def columnar_output_type_handler(cursor, name, default_type, size, precision, scale):
+    """ --columnar: NUMBER & DATE are converted to text by oracle client into string arrays """
+    if default_type in COLUMNAR_TYPES:
+        return cursor.var(str, ORA_NUMBER_WIDTH + 24, arraysize=cursor.arraysize)
+    return blob_output_type_handler(cursor, name, default_type, size, precision, scale)
+
+def ora_execute(curs, query, output_type_handler):
+    """ execute query with output variables defined by handler, later queries fetch as usual """
+    curs.outputtypehandler = output_type_handler
+    try:
+        curs.execute(query)
+    finally:
+        curs.outputtypehandler = None
+
+def encode_copy_columns(codecs, ora_rows) -> bytes:
+    """
+        encode whole batch column by column, codec None - text column needs no escaping
+        >>> encode_copy_columns((None, copy_text), [('1', 'a\\tb'), (None, None)])
+        b'1\\ta\\\\\\tb\\n\\\\N\\t\\\\N\\n'
+    """
+    columns = []
+    for codec, column in zip(codecs, zip(*ora_rows)):
+        if codec is not None:
+            columns.append(list(map(codec, column)))
+        elif None in column:
+            columns.append(['\\N' if data is None else data for data in column])
+        else:
+            columns.append(column)
+    return ('\n'.join(map('\t'.join, zip(*columns))) + '\n').encode('utf-8')
+
+RowEncoder = namedtuple('RowEncoder', 'copy_row,insert_row,formatted,copy_rows',
+                        defaults=(False, None))
+
+def build_row_encoder(description, bin_cols, columnar=False) -> RowEncoder:
+    """
+        per column codecs compiled once from cursor description,
+        insert_row is None when rows are inserted as fetched,
+        copy_rows encodes whole batch when NUMBER & DATE are fetched as text
+        >>> enc = build_row_encoder([('ID', cx_Oracle.NUMBER), ('NAME', cx_Oracle.STRING),
+        ...                          ('CREATED', cx_Oracle.DATETIME), ('DATA', cx_Oracle.STRING)], ['DATA'])
+        >>> enc.copy_row((1, 'a\\tb', None, 'x'))
+        b'1\\ta\\\\\\tb\\t\\\\N\\t\\\\\\\\x78\\n'
+        >>> enc.insert_row((1, 'ab', None, '\x04'))
+        (1, 'ab', None, b'\\x04')
+        >>> build_row_encoder([('ID', cx_Oracle.NUMBER), ('RAW', cx_Oracle.BINARY)], []).copy_row((1, b'\\x00\\t'))
+        b'1\\t\\\\\\\\x0009\\n'
+    """
+    copy_codecs = tuple([copy_bin_text if col[0] in bin_cols and col[1] not in BINARY_TYPES
+                         else COPY_CODECS.get(col[1], escape) for col in description])
+    insert_codecs = tuple([insert_bin if col[0] in bin_cols else None for col in description])
+    column_codecs = tuple([None if col[1] in COLUMNAR_TYPES else codec
+                           for col, codec in zip(description, copy_codecs)])
+    return RowEncoder(
+        copy_row=partial(encode_copy_row, copy_codecs),
+        insert_row=partial(encode_insert_row, insert_codecs) if any(insert_codecs) else None,
+        copy_rows=partial(encode_copy_columns, column_codecs) if columnar else None)
+
+def encode_insert_rows(ora_rows, encoder) -> list:
+    """ ora rows for PG INSERT """
+    if encoder.insert_row is None:
+        return ora_rows
+    return [encoder.insert_row(row) for row in ora_rows]
+
+ORA_LINE_LIMIT = 4000 # max VARCHAR2 length of a COPY line built by oracle
+ORA_NUMBER_WIDTH = 40 # max TO_CHAR(NUMBER) length
+ORA_DATE_FORMAT = 'YYYY-MM-DD HH24:MI:SS' # str(datetime) of DATE
+ORA_COPY_ESCAPE = ("'\\'", 'CHR(8)', 'CHR(12)', 'CHR(10)', 'CHR(13)', 'CHR(9)', 'CHR(11)') # COPY_ESCAPE
+
+def ora_copy_text_expr(name) -> str:
+    """
+        oracle expression escaping VARCHAR2 column for PG COPY like copy_text
+        >>> print(ora_copy_text_expr('"A"').replace('REPLACE(', '('))
+        ((((((("A", '\\', '\\'||'\\'), CHR(8), '\\'||CHR(8)), CHR(12), '\\'||CHR(12)), CHR(10), '\\'||CHR(10)), CHR(13), '\\'||CHR(13)), CHR(9), '\\'||CHR(9)), CHR(11), '\\'||CHR(11))
+    """
+    expr = name
+    for char in ORA_COPY_ESCAPE:
+        expr = "REPLACE(%s, %s, '\\'||%s)" % (expr, char, char)
+    return expr
+
+def ora_copy_col_expr(col) -> tuple or None:
+    """
+        (expression, max length) of one column in COPY line,
+        None if oracle can't format the column exactly as build_row_encoder does
+        >>> print(ora_copy_col_expr(('ID', cx_Oracle.NUMBER, 11, 22, 10, 0, 0))[0])
+        NVL(TO_CHAR("ID"), '\\N')
+        >>> ora_copy_col_expr(('PRICE', cx_Oracle.NUMBER, 11, 22, 10, 2, 1)) is None
+        True
+        >>> ora_copy_col_expr(('D', cx_Oracle.DATETIME, 23, 7, None, None, 1))[1]
+        19
+    """
+    name, col_type, _, internal_size, precision, scale = col[:6]
+    if not re.match(r'^[A-Z][A-Z0-9_$#]*$', name):
+        return None
+    name = '"%s"' % name
+    if col_type == cx_Oracle.NUMBER and scale == 0 and precision:
+        # NUMBER(p), fetched as python int
+        expr, width = "TO_CHAR(%s)" % name, ORA_NUMBER_WIDTH
+    elif col_type == cx_Oracle.DATETIME:
+        expr, width = "TO_CHAR(%s, '%s')" % (name, ORA_DATE_FORMAT), len('2019-01-01 00:00:00')
+    elif col_type in (cx_Oracle.STRING, cx_Oracle.FIXED_CHAR):
+        expr, width = ora_copy_text_expr(name), internal_size * 2
+    else:
+        return None
+    return "NVL(%s, '\\N')" % expr, width
+
+def ora_copy_line_expr(description) -> str or None:
+    """
+        oracle expression of PG COPY text line, None if some column can't be
+        formatted by oracle or the line may exceed VARCHAR2 limit
+        >>> print(ora_copy_line_expr([('ID', cx_Oracle.NUMBER, 11, 22, 10, 0, 0),
+        ...                           ('D', cx_Oracle.DATETIME, 23, 7, None, None, 1)]))
+        NVL(TO_CHAR("ID"), '\\N')||CHR(9)||NVL(TO_CHAR("D", 'YYYY-MM-DD HH24:MI:SS'), '\\N')||CHR(10)
+        >>> ora_copy_line_expr([('B', cx_Oracle.BLOB, 0, 0, 0, 0, 1)]) is None
+        True
+        >>> ora_copy_line_expr([('S', cx_Oracle.STRING, 4000, 4000, 0, 0, 1)]) is None
+        True
+    """
+    exprs = [ora_copy_col_expr(col) for col in description]
+    if None in exprs:
+        return None
+    if sum([width + 1 for _, width in exprs]) > ORA_LINE_LIMIT:
+        return None
+    return '||CHR(9)||'.join([expr for expr, _ in exprs]) + '||CHR(10)'
+
+def copy_formatted_row(ora_row):
+    """ COPY line made by oracle """
+    return ora_row[0].encode('utf-8')
+
+def ora_format_rows(curs, query, encoder, handler, args) -> RowEncoder:
+    """
+        --ora-format: re-execute query to get COPY lines made by oracle if they
+        match the python encoder on --ora-format-check first rows,
+        otherwise re-execute query with the same output type handler and keep encoder
+    """
+    line_expr = ora_copy_line_expr(curs.description)
+    if line_expr is None:
+        LOGGER.info('ora format: column types not supported, python encoder is used')
+        return encoder
+    check_query = "select " + line_expr + ", t.* from (" + query + ") t " \
+                  "where rownum <= %d" % args.ora_format_check
+    LOGGER.debug(check_query)
+    ora_execute(curs, check_query, handler)
+    for row in curs:
+        if row[0].encode('utf-8') != encoder.copy_row(row[1:]):
+            LOGGER.warning('ora format: line %r differs from %r, python encoder is used',
+                           row[0], encoder.copy_row(row[1:]))
+            ora_execute(curs, query, handler)
+            return encoder
+    line_query = "select " + line_expr + " from (" + query + ")"
+    LOGGER.debug(line_query)
+    curs.execute(line_query)
+    return RowEncoder(copy_row=copy_formatted_row, insert_row=None, formatted=True)
 
 def mask_col(col):
     """ mask PG kw columns """
@@ -109,12 +617,87 @@ def mask_col(col):
         return '"%s"' % col
     return col
 
-def ora_data2pg_copy(ora_rows, pool):
-    """ oracle result rows to PG COPY string """
-    if pool is None:
-        return [escape_row(r) for r in ora_rows]
-    else:
-        return pool.map(escape_row, ora_rows)
+def ora_data2pg_copy(ora_rows, encoder, pool):
+    """ oracle result rows to PG COPY lines """
+    if pool is None or encoder.formatted:
+        return map(encoder.copy_row, ora_rows)
+    return pool.imap(encoder.copy_row, ora_rows, ENCODE_CHUNKSIZE)
+
+def count_copy_bytes(args, nbytes):
+    """ COPY bytes of table for history and --max-mb-per-sec """
+    args.table_stats['bytes'] += nbytes
+    args.throttle.consume_bytes(nbytes)
+
+def load_copy_data(ins, data, args) -> bool:
+    """ COPY encoded lines to PG, False on UniqueError """
+    count_copy_bytes(args, len(data))
+    try:
+        ins.load_rows([data])
+        return True
+    except postgresql.exceptions.UniqueError:
+        LOGGER.error('UniqueError on batch copy.')
+        if args.fast_load:
+            # transaction is aborted, row by row retry is impossible
+            raise
+        return False
+
+def flush_copy_lines(ins, lines, args) -> bool:
+    """ COPY lines to PG joined once, py-postgresql takes exact bytes only, False on UniqueError """
+    try:
+        return load_copy_data(ins, b''.join(lines), args)
+    finally:
+        del lines[:]
+
+def copy_columns_batch(ins, rows, encoder, args) -> list:
+    """
+        --columnar: encode batch at once, by smaller slices of rows when
+        it exceeds --max-buffer-mb. returns rows failed to load
+    """
+    failed_rows = []
+    start, step = 0, len(rows)
+    while start < len(rows):
+        data = encoder.copy_rows(rows[start:start + step])
+        if len(data) > args.max_buffer_size and step > 1:
+            # slice size by bytes per row of the too large one
+            step = max(1, step * args.max_buffer_size // len(data))
+            continue
+        if not load_copy_data(ins, data, args):
+            failed_rows.extend(rows[start:start + step])
+        start += step
+    return failed_rows
+
+def copy_batch(ins, rows, encoder, args) -> list:
+    """
+        encode rows and COPY them to PG, flush early when encoded lines
+        exceed --max-buffer-mb. returns rows failed to load
+    """
+    if encoder.copy_rows is not None:
+        return copy_columns_batch(ins, rows, encoder, args)
+    lines = []
+    size = 0
+    failed_rows = []
+    start = 0
+    for n, line in enumerate(ora_data2pg_copy(rows, encoder, args.pool), 1):
+        lines.append(line)
+        size += len(line)
+        if size >= args.max_buffer_size:
+            if not flush_copy_lines(ins, lines, args):
+                failed_rows.extend(rows[start:n])
+            start, size = n, 0
+    if lines and not flush_copy_lines(ins, lines, args):
+        failed_rows.extend(rows[start:])
+    return failed_rows
+
+def insert_batch(ins, rows, encoder, args) -> list:
+    """ insert rows to PG, returns rows failed to load """
+    try:
+        ins.load_rows(encode_insert_rows(rows, encoder))
+        return []
+    except postgresql.exceptions.UniqueError:
+        LOGGER.error('UniqueError on batch insert.')
+        if args.fast_load:
+            raise
+        return rows
 
 def values_list(cols: [str], bin_cols: [str]) -> [str]:
     """
@@ -129,84 +712,412 @@ def values_list(cols: [str], bin_cols: [str]) -> [str]:
             res.append('$%d' % (n+1))
     return res
 
-def encode_bin(data_rows, cols, bin_cols) -> list:
-    """
-        >>> encode_bin([('1', '2', '4', '\x01'), ('2','2','4','\x04')], ['col1', 'col2', 'col3', 'col4'], ['col4'])
-        [('1', '2', '4', b'\\x01'), ('2', '2', '4', b'\\x04')]
-    """
-    res = []
-    for row in data_rows:
-        res_row = []
-        for n, col in enumerate(cols):
-            if col in bin_cols and row[n]:
-                res_row.append(row[n].encode('cp866'))
-            else:
-                res_row.append(row[n])
-        res.append(tuple(res_row))
-    return res
-
 
-def copy_table(curs, dbpg, tab, args):
-    total_rows = 0 if args.skip_count else ora_count_rows(curs, tab, args)
-    pbar = tqdm(desc=tab, total=total_rows)
-    query = "select * from " + tab
-    if tab in args.replace_query:
-        query = args.replace_query[tab]
+def copy_table(curs, dbpgs, tab, args, partition=None, target=None):
+    """ copy table or one of its partitions to PG table target on every PG db """
+    target = target or tab
+    desc = tab if partition is None else tab + ':' + partition
+    args.batch_rowcount = args.batch_sizes.get(desc, args.default_batch_rowcount)
+    args.table_stats = {'bytes': 0, 'errors': 0}
+    start = time.time()
+    total_rows = None
+    count = None
+    if not args.skip_count:
+        if tab not in args.replace_query:
+            total_rows = ora_stat_rows(curs, tab, partition)
+        if args.exact_count:
+            count = start_background_count(tab, args, partition)
+    pbar = tqdm(desc=desc, total=total_rows)
+    query = ora_select_query(tab, args, partition)
 
     LOGGER.debug(query)
-    curs.execute(query)
+    columnar = args.columnar and args.use_copy
+    handler = columnar_output_type_handler if columnar else blob_output_type_handler
+    ora_execute(curs, query, handler)
 
     cols = [col[0] for col in curs.description]
     columns_masked = ','.join(['%s' % mask_col(col) for col in cols])
+    bin_cols = args.bin_cols + binary_columns(curs.description)
+    encoder = build_row_encoder(curs.description, bin_cols, columnar)
+
+    shard_key = args.shard_keys.get(tab) if len(dbpgs) > 1 else None
+    if shard_key is not None and shard_key not in cols:
+        raise Exception('Shard key %s is not selected from %s' % (shard_key, tab))
+    if args.use_copy and args.ora_format and shard_key is None:
+        encoder = ora_format_rows(curs, query, encoder, handler, args)
 
     if args.use_copy:
-        pg_query = "copy " + tab + "(" + columns_masked + ") from STDIN"
+        pg_query = "copy " + target + "(" + columns_masked + ") from STDIN" + \
+                   pg_copy_freeze(target, args)
     else:
-        values = values_list(cols, args.bin_cols)
-        pg_query = "insert into " + tab + "(" + columns_masked + ") " + \
+        values = values_list(cols, bin_cols)
+        pg_query = "insert into " + target + "(" + columns_masked + ") " + \
                    "values (" + ','.join(values) + ")"
 
     LOGGER.debug(pg_query)
-    ins = dbpg.prepare(pg_query)
+    dbpg = dbpgs[0]
+    failed = True
+    try:
+        if shard_key is not None:
+            copy_rows_sharded(curs, dbpgs, target, pg_query, encoder, cols.index(shard_key),
+                              pbar, args, count)
+        elif len(dbpgs) > 1:
+            copy_rows_fanout(curs, dbpgs, target, pg_query, encoder, pbar, args, count)
+        elif args.fast_load:
+            # FREEZE requires the table to be truncated in the same transaction
+            with dbpg.xact():
+                pg_truncate_tab(dbpg, target)
+                copy_rows(curs, dbpg.prepare(pg_query), encoder, pbar, args, count)
+        else:
+            copy_rows(curs, dbpg.prepare(pg_query), encoder, pbar, args, count)
+        failed = False
+    finally:
+        stop_background_count(count)
+        pbar.close()
+        record_table(args, desc, pbar.n, args.table_stats['bytes'], time.time() - start,
+                     args.table_stats['errors'] + failed)
+
+
+def retry_rows(ins, rows, encoder, args, tab):
+    """ load rows one by one, skip duplicates """
+    for row in rows:
+        try:
+            ins.load_rows([encoder.copy_row(row)] \
+                if args.use_copy else encode_insert_rows([row], encoder))
+        except postgresql.exceptions.UniqueError:
+            LOGGER.error('UniqueError on insert: %s', row, extra={'table': tab})
+            args.table_stats['errors'] += 1
+
+TargetLoader = namedtuple('TargetLoader', 'name,queue,thread,status')
+
+def target_name(uri) -> str:
+    """
+        PG connect string without password
+        >>> target_name('pq://user:secret@pghost:5432/db')
+        'pq://user@pghost:5432/db'
+    """
+    return re.sub(r':[^:@/]*@', '@', uri)
 
+def load_queue(ins, batches, encoder, status, args):
+    """ load batches from queue until None """
     while True:
-        uniq_error = False
-        rows = curs.fetchmany(args.batch_rowcount)
-        if not rows:
-            break
+        batch = batches.get()
+        if batch is None:
+            return
+        payload, rows = batch
         try:
-            ins.load_rows(ora_data2pg_copy(rows, args.pool) \
-                if args.use_copy else encode_bin(rows, cols, args.bin_cols))
+            ins.load_rows([payload] if args.use_copy else payload)
         except postgresql.exceptions.UniqueError:
-            LOGGER.error('UniqueError on batch insert.')
-            uniq_error = True
-        if uniq_error:
-            for row in rows:
-                try:
-                    ins.load_rows(ora_data2pg_copy([row], args.pool) \
-                        if args.use_copy else encode_bin([row], cols, args.bin_cols))
-                    pbar.update(1)
-                except postgresql.exceptions.UniqueError:
-                    LOGGER.error('UniqueError on insert: %s', row)
-
-        pbar.update(len(rows))
-    pbar.close()
+            LOGGER.error('%s: UniqueError on batch load.', status['name'])
+            if args.fast_load:
+                raise
+            retry_rows(ins, rows, encoder, args, status['target'])
+        status['rows'] += len(rows)
+
+def start_loader(name, dbpg, target, pg_query, encoder, args) -> TargetLoader:
+    """ load encoded batches to one PG target in own thread """
+    batches = queue.Queue(args.target_buffer)
+    status = {'name': name, 'target': target, 'rows': 0, 'error': None}
+
+    def load():
+        try:
+            ins = dbpg.prepare(pg_query)
+            if args.fast_load:
+                with dbpg.xact():
+                    pg_truncate_tab(dbpg, target)
+                    load_queue(ins, batches, encoder, status, args)
+            else:
+                load_queue(ins, batches, encoder, status, args)
+        except Exception as ex:
+            LOGGER.error('%s: %s failed: %s', name, target, ex)
+            status['error'] = ex
+            # keep reading, the other targets must not wait for this one
+            while batches.get() is not None:
+                pass
+
+    thread = threading.Thread(target=load, name='load ' + name, daemon=True)
+    thread.start()
+    return TargetLoader(name, batches, thread, status)
+
+def encode_batch(rows, encoder, args):
+    """ COPY payload or INSERT rows of batch for load_queue """
+    if not args.use_copy:
+        return encode_insert_rows(rows, encoder)
+    if encoder.copy_rows is not None:
+        payload = encoder.copy_rows(rows)
+    else:
+        payload = b''.join(ora_data2pg_copy(rows, encoder, args.pool))
+    count_copy_bytes(args, len(payload))
+    return payload
+
+def copy_rows_fanout(curs, dbpgs, target, pg_query, encoder, pbar, args, count=None):
+    """ fetch & encode batch once, load it to every PG target by own loader thread """
+    loaders = [start_loader(target_name(uri), dbpg, target, pg_query, encoder, args)
+               for uri, dbpg in zip(args.pg_uris, dbpgs)]
+    try:
+        while True:
+            rows = args.throttle.fetch(curs, args.batch_rowcount)
+            if not rows:
+                break
+            payload = encode_batch(rows, encoder, args)
+            for loader in loaders:
+                # blocks when the target is --target-buffer batches behind
+                loader.queue.put((payload, rows))
+            show_progress(pbar, rows, args, count)
+    finally:
+        stop_loaders(loaders)
+    collect_target_status(loaders, target, args)
+
+def shard_no(key, shards) -> int:
+    """
+        shard of distribution key value: crc32 of its text % number of shards
+        >>> [shard_no(key, 3) for key in (1, 2, 'abc', None)]
+        [2, 1, 0, 0]
+    """
+    if key is None:
+        return 0
+    return zlib.crc32(str(key).encode('utf-8')) % shards
+
+def split_shards(rows, key_index, shards) -> list:
+    """
+        >>> split_shards([(3, 'a'), (4, 'b'), (5, 'c')], 0, 2)
+        [[(4, 'b'), (5, 'c')], [(3, 'a')]]
+    """
+    shard_rows = [[] for _ in range(shards)]
+    for row in rows:
+        shard_rows[shard_no(row[key_index], shards)].append(row)
+    return shard_rows
+
+def copy_rows_sharded(curs, dbpgs, target, pg_query, encoder, key_index, pbar, args, count=None):
+    """ route each row by hash of the distribution column to its PG node loader thread """
+    loaders = [start_loader(target_name(uri), dbpg, target, pg_query, encoder, args)
+               for uri, dbpg in zip(args.pg_uris, dbpgs)]
+    try:
+        while True:
+            rows = args.throttle.fetch(curs, args.batch_rowcount)
+            if not rows:
+                break
+            for loader, shard_rows in zip(loaders, split_shards(rows, key_index, len(loaders))):
+                if shard_rows:
+                    loader.queue.put((encode_batch(shard_rows, encoder, args), shard_rows))
+            show_progress(pbar, rows, args, count)
+    finally:
+        stop_loaders(loaders)
+    collect_target_status(loaders, target, args)
+    resstr = '%s shards: %s' % (target, ', '.join(
+        ['%s %d' % (loader.name, loader.status['rows']) for loader in loaders]))
+    LOGGER.info(resstr)
+    print(resstr)
+
+def stop_loaders(loaders):
+    """ send end of data and wait for loader threads """
+    for loader in loaders:
+        loader.queue.put(None)
+    for loader in loaders:
+        loader.thread.join()
+
+def collect_target_status(loaders, target, args):
+    """ add rows loaded & failed table of loaders to per target totals """
+    for loader in loaders:
+        target_status = args.target_status.setdefault(loader.name, {'rows': 0, 'failed': []})
+        target_status['rows'] += loader.status['rows']
+        if loader.status['error'] is not None:
+            target_status['failed'].append(target)
+            print('%s: %s failed: %s' % (loader.name, target, loader.status['error']))
+
+def print_target_status(args):
+    """ rows loaded & failed tables per PG target """
+    for name, target_status in args.target_status.items():
+        resstr = "%s: %d rows, failed: %s" % (
+            name, target_status['rows'], ', '.join(target_status['failed']) or '-')
+        LOGGER.info(resstr)
+        print(resstr)
+
+def copy_rows(curs, ins, encoder, pbar, args, count=None):
+    """ fetch source rows and load them into PG by batches """
+    prof = new_profile(args)
+    for batch_no in itertools.count():
+        with profile_batch(prof, args, batch_no):
+            rows = args.throttle.fetch(curs, args.batch_rowcount)
+            if not rows:
+                break
+            if args.use_copy:
+                failed_rows = copy_batch(ins, rows, encoder, args)
+            else:
+                failed_rows = insert_batch(ins, rows, encoder, args)
+            retry_rows(ins, failed_rows, encoder, args, pbar.desc)
 
+        show_progress(pbar, rows, args, count)
+    save_profile(prof, args, pbar.desc)
 
-def copy_tables(curs, dbpg, args):
+
+def copy_tables(curs, dbpgs, args):
     """ copy tables """
     if args.processes > 1:
         args.pool = Pool(args.processes)
     else:
         args.pool = None
 
-    for tab in args.tables_to_copy:
-        copy_table(curs, dbpg, tab, args)
+    tables = plan_columns(curs, dbpgs[0], args)
+    if args.columnar:
+        ora_copy_session(curs)
+
+    partitioned = get_ora_partitioned_tabs(curs)
+    if args.fast_load:
+        # each partition is truncated & loaded with FREEZE straight into its PG partition,
+        # tables not partitioned the same way in PG are copied as a whole
+        partitioned = {tab: partitioning for tab, partitioning in partitioned.items()
+                       if tab in args.pg_partitions and partitioning[0] in ROUTED_PARTITIONING
+                       and all([pg_partition_name(tab, partition) in args.pg_partitions[tab]
+                                for partition in partitioning[1]])}
+
+    small_tabs = []
+    if args.small_table_rows and args.use_copy and len(dbpgs) == 1:
+        small = get_ora_small_tabs(curs, args.small_table_rows)
+        small_tabs = [tab for tab in tables
+                      if tab in small and tab not in args.replace_query]
+        small_tabs = set(small_tabs) - set(copy_small_tables(curs, dbpgs[0], small_tabs, args))
+
+    for tab in tables:
+        if tab in small_tabs:
+            continue
+        if tab in partitioned and tab not in args.replace_query:
+            copy_partitions(curs, dbpgs, tab, partitioned[tab], args)
+        else:
+            copy_table(curs, dbpgs, tab, args)
 
     if args.pool is not None:
         args.pool.close()
         args.pool.join()
 
+def get_ora_small_tabs(curs, max_rows) -> set:
+    """ oracle user tables with less than max_rows rows by optimizer statistics """
+    query = "select table_name from user_tables where num_rows < :max_rows"
+    LOGGER.debug("query=%s, max_rows=%d", query, max_rows)
+    curs.execute(query, {'max_rows': max_rows})
+    return {row[0] for row in curs.fetchall()}
+
+def fetch_small_table(curs, tab, args) -> tuple or None:
+    """
+        fetch tiny table in one round trip and encode it for COPY,
+        None if table is bigger than statistics say
+    """
+    limit = SMALL_TABLE_LIMIT_FACTOR * args.small_table_rows
+    query = ora_select_query(tab, args)
+    LOGGER.debug(query)
+    curs.execute(query)
+    rows = args.throttle.fetch(curs, limit)
+    if len(rows) == limit:
+        LOGGER.info('%s: statistics are stale, not a small table', tab)
+        return None
+
+    columns_masked = ','.join([mask_col(col[0]) for col in curs.description])
+    pg_query = "copy " + tab + "(" + columns_masked + ") from STDIN" + pg_copy_freeze(tab, args)
+    encoder = build_row_encoder(curs.description, args.bin_cols)
+    data = b''.join(map(encoder.copy_row, rows))
+    args.throttle.consume_bytes(len(data))
+    return pg_query, data, len(rows)
+
+def copy_small_tables(curs, dbpg, tables, args) -> list:
+    """
+        copy tiny tables by groups, each group in one PG transaction.
+        returns tables to copy as usual
+    """
+    small_curs = curs.connection.cursor()
+    small_curs.outputtypehandler = blob_output_type_handler
+    small_curs.arraysize = SMALL_TABLE_LIMIT_FACTOR * args.small_table_rows
+    fallback = []
+    pbar = tqdm(desc='small tables', total=len(tables))
+    for group in chunks(tables, args.small_table_group):
+        loads = []
+        for tab in group:
+            fetched = fetch_small_table(small_curs, tab, args)
+            if fetched is None:
+                fallback.append(tab)
+            else:
+                loads.append((tab,) + fetched)
+        try:
+            with dbpg.xact():
+                for tab, pg_query, data, rows in loads:
+                    LOGGER.debug('%s, rows=%d', pg_query, rows)
+                    if args.fast_load:
+                        pg_truncate_tab(dbpg, tab)
+                    if data:
+                        dbpg.prepare(pg_query).load_rows([data])
+        except postgresql.exceptions.UniqueError:
+            if args.fast_load:
+                raise
+            LOGGER.error('UniqueError in small tables group, copy them one by one')
+            fallback.extend([load[0] for load in loads])
+        pbar.update(len(group))
+    pbar.close()
+    small_curs.close()
+    return fallback
+
+ROUTED_PARTITIONING = ('RANGE', 'LIST')
+
+def partition_target(tab, part_type, partition, args) -> str:
+    """ PG table to load partition rows to """
+    # oracle and PG hash functions differ, hash partitions go through tuple routing
+    if (args.route_partitions or args.fast_load) and part_type in ROUTED_PARTITIONING:
+        return pg_partition_name(tab, partition)
+    return tab
+
+def copy_partitions(curs, dbpgs, tab, partitioning, args):
+    """ copy each partition of oracle table as separate unit of work """
+    part_type, partitions = partitioning
+    units = [(tab, partition, partition_target(tab, part_type, partition, args))
+             for partition in partitions]
+    if args.sessions < 2:
+        for unit_tab, partition, target in units:
+            copy_table(curs, dbpgs, unit_tab, args, partition, target)
+        return
+
+    sessions = min(args.sessions, len(units))
+    worker_args = argparse.Namespace(**dict(vars(args), pool=None, target_status=OrderedDict(),
+                                            throttle=Throttle(args, 1 / sessions)))
+    with Pool(sessions) as pool:
+        statuses = pool.map(copy_partition_worker, [unit + (worker_args,) for unit in units], 1)
+    for worker_status in statuses:
+        merge_target_status(args, worker_status)
+
+def merge_target_status(args, worker_status):
+    """
+        add per target totals of worker process to args.target_status
+        >>> import argparse
+        >>> args = argparse.Namespace(target_status=OrderedDict(
+        ...     [('pq://a', {'rows': 5, 'failed': []})]))
+        >>> merge_target_status(args, {'pq://a': {'rows': 2, 'failed': ['T_P1']},
+        ...                            'pq://b': {'rows': 2, 'failed': []}})
+        >>> list(args.target_status.items())
+        [('pq://a', {'rows': 7, 'failed': ['T_P1']}), ('pq://b', {'rows': 2, 'failed': []})]
+    """
+    for name, status in worker_status.items():
+        target_status = args.target_status.setdefault(name, {'rows': 0, 'failed': []})
+        target_status['rows'] += status['rows']
+        target_status['failed'].extend(status['failed'])
+
+def copy_partition_worker(unit) -> dict:
+    """ copy partition in own ORA & PG sessions, returns per target status of several PG """
+    tab, partition, target, args = unit
+    dbpgs = [postgresql.open(uri) for uri in args.pg_uris]
+    dbora = cx_Oracle.connect(args.ora_uri)
+    curs = dbora.cursor()
+    if args.columnar:
+        ora_copy_session(curs)
+    if args.fast_load:
+        for dbpg in dbpgs:
+            pg_fast_load_session(dbpg)
+    try:
+        copy_table(curs, dbpgs, tab, args, partition, target)
+    finally:
+        curs.close()
+        dbora.close()
+        for dbpg in dbpgs:
+            dbpg.close()
+        flush_table_errors()
+    return args.target_status
+
 def compare_tables(curs, dbpg, args):
     """ compare tables """
     counts = []
@@ -244,18 +1155,29 @@ def compare_table(curs, dbpg, tab, args) -> list:
 
 def pg_disable_triggers(dbpg, tables):
     """ disable triggers """
-    for tab in reversed(tables):
-        pg_disable_triggers_tab(dbpg, tab)
+    pg_execute_blocks(dbpg, ["ALTER TABLE " + tab + " DISABLE TRIGGER USER;"
+                             for tab in reversed(tables)])
 
 def pg_truncate_tabs(dbpg, tables):
-    """ clear tables """
-    for tab in reversed(tables):
-        pg_truncate_tab(dbpg, tab)
+    """ clear tables, one TRUNCATE per DDL_BLOCK_SIZE tables """
+    for block in chunks(list(reversed(tables)), DDL_BLOCK_SIZE):
+        query = "truncate table " + ", ".join(block)
+        LOGGER.debug(query)
+        dbpg.execute(query)
 
 def pg_enable_triggers(dbpg, tables):
     """ enable triggers """
-    for tab in reversed(tables):
-        pg_enable_trigger_tab(dbpg, tab)
+    pg_execute_blocks(dbpg, ["ALTER TABLE " + tab + " ENABLE TRIGGER USER;"
+                             for tab in reversed(tables)])
+
+def for_each_pg(dbpgs, func, *func_args):
+    """ func(dbpg, *func_args) on every PG target, targets in parallel threads """
+    if len(dbpgs) == 1:
+        func(dbpgs[0], *func_args)
+        return
+    with ThreadPoolExecutor(len(dbpgs)) as executor:
+        for future in [executor.submit(func, dbpg, *func_args) for dbpg in dbpgs]:
+            future.result()
 
 def cmp_tab_list(curs, args):
     ora_tabs = get_ora_user_tabs(curs)
@@ -286,29 +1208,36 @@ def confirm_truncate_tabs():
         return True
     return False
 
-def pg_get_seq_last_value(dbpg, seq_name) -> int:
-    """ return last number pg seq """
-    last_number = dbpg.prepare("select last_value from " + seq_name)
-    return last_number()[0][0]
+def chunks(items: list, size: int):
+    """
+        >>> list(chunks([1, 2, 3, 4, 5], 2))
+        [[1, 2], [3, 4], [5]]
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
 
+def pg_get_seq_last_values(dbpg) -> dict:
+    """ {SEQ_NAME: last_value} for all PG sequences, one query """
+    seq_req = dbpg.prepare("SELECT sequencename, coalesce(last_value, start_value) "
+                           "FROM pg_sequences WHERE schemaname = ANY (current_schemas(false))")
+    return {seq[0].upper(): seq[1] for seq in seq_req()}
 
-def pg_get_seqs(dbpg):
-    seq_req = dbpg.prepare("""SELECT relname FROM pg_class WHERE relkind = 'S'""")
-    return [seq[0].upper() for seq in seq_req()]
+def ora_get_seq_last_numbers(curs) -> dict:
+    """ {SEQ_NAME: last_number} for all oracle user sequences, one query """
+    curs.execute("SELECT sequence_name, last_number FROM user_sequences")
+    return dict(curs.fetchall())
 
 def pg_seq_last_number_fix(curs, dbpg):
     """ update sequences last numbers: ORA->PG """
-    pg_seqs = pg_get_seqs(dbpg)
+    pg_seqs = pg_get_seq_last_values(dbpg)
 
-    seq_qry = """SELECT sequence_name, last_number FROM user_sequences"""
-    curs.execute(seq_qry)
-    for seq in curs.fetchall():
-        seq_name, last_number = seq
+    seq_alters = []
+    for seq_name, last_number in sorted(ora_get_seq_last_numbers(curs).items()):
         if seq_name not in pg_seqs:
             LOGGER.info('sequence %s not found in PG, ignore', seq_name)
             continue
 
-        pg_last_number = pg_get_seq_last_value(dbpg, seq_name)
+        pg_last_number = pg_seqs[seq_name]
         if pg_last_number > last_number:
             LOGGER.info('sequence %s has value bigger then Ora [%d > %d], ignore', seq_name, pg_last_number, last_number)
             continue
@@ -317,53 +1246,316 @@ def pg_seq_last_number_fix(curs, dbpg):
 
         LOGGER.info(seq_alter)
         print(seq_alter)
+        seq_alters.append(seq_alter + ";")
 
-        alter = dbpg.prepare(seq_alter)
-        alter()
+    for block in chunks(seq_alters, SEQ_BLOCK_SIZE):
+        dbpg.execute("DO $$BEGIN\n" + "\n".join(block) + "\nEND$$")
 
-def main(args):
-    """ main """
-    LOGGER.debug('binary cols=%s', args.bin_cols)
+def open_compressed(path, mode, compress=None, level=None):
+    """ open gzip or lzma file, compression is detected by file extension on read """
+    if compress is None:
+        compress = 'lzma' if path.endswith('.' + COMPRESS_EXT['lzma']) else 'gzip'
+    if compress == 'lzma':
+        return lzma.open(path, mode, preset=level)
+    return gzip.open(path, mode, compresslevel=9 if level is None else level)
 
+def extract_file_name(tab, partition, chunk, compress, rowid_range=None) -> str:
+    """
+        >>> extract_file_name('SALES', 'P2019', 0, 'gzip')
+        'SALES.P2019.0000.copy.gz'
+        >>> extract_file_name('SALES', None, 12, 'lzma')
+        'SALES.0012.copy.xz'
+        >>> extract_file_name('SALES', None, 0, 'gzip', (3, 'AAAx', 'AAAy'))
+        'SALES.R0003.0000.copy.gz'
+    """
+    name = [tab] if partition is None else [tab, partition]
+    if rowid_range is not None:
+        name.append('R%04d' % rowid_range[0])
+    return '.'.join(name + ['%04d' % chunk, 'copy', COMPRESS_EXT[compress]])
 
-    dbpg = postgresql.open(args.pg_uri)
+def ora_rowid_ranges(curs, tab, chunks) -> list:
+    """
+        split table by its extents into about chunks ROWID ranges of equal
+        number of blocks: [(no, low rowid, high rowid), ...]
+    """
+    query = """select grp,
+dbms_rowid.rowid_create(1, o.data_object_id, lo_fno, lo_block, 0),
+dbms_rowid.rowid_create(1, o.data_object_id, hi_fno, hi_block, 32767)
+from (select distinct grp,
+      first_value(relative_fno) over (partition by grp order by relative_fno, block_id
+          rows between unbounded preceding and unbounded following) lo_fno,
+      first_value(block_id) over (partition by grp order by relative_fno, block_id
+          rows between unbounded preceding and unbounded following) lo_block,
+      last_value(relative_fno) over (partition by grp order by relative_fno, block_id
+          rows between unbounded preceding and unbounded following) hi_fno,
+      last_value(block_id + blocks - 1) over (partition by grp order by relative_fno, block_id
+          rows between unbounded preceding and unbounded following) hi_block
+      from (select relative_fno, block_id, blocks,
+            trunc((sum(blocks) over (order by relative_fno, block_id) - 0.01) /
+                  (sum(blocks) over () / :chunks)) grp
+            from user_extents
+            where segment_name = :tab and segment_type = 'TABLE')) e,
+     user_objects o
+where o.object_name = :tab and o.object_type = 'TABLE'
+order by grp"""
+    LOGGER.debug("query=%s, tab=%s, chunks=%d", query, tab, chunks)
+    curs.execute(query, {'tab': tab, 'chunks': chunks})
+    return [(int(no), low, high) for no, low, high in curs.fetchall()]
+
+def extract_units(curs, tab, partitioned, args) -> list:
+    """
+        units of work of table: its partitions, with --chunk-rows ROWID ranges
+        of about chunk rows by statistics, otherwise the whole table
+    """
+    if tab in args.replace_query:
+        return [(tab, None, None, args)]
+    if tab in partitioned:
+        return [(tab, partition, None, args) for partition in partitioned[tab][1]]
+    num_rows = ora_stat_rows(curs, tab) if args.chunk_rows else None
+    if not num_rows or num_rows <= args.chunk_rows:
+        return [(tab, None, None, args)]
+    ranges = ora_rowid_ranges(curs, tab, -(-num_rows // args.chunk_rows))
+    LOGGER.info('%s: %d rows by statistics, %d rowid ranges', tab, num_rows, len(ranges))
+    return [(tab, None, rowid_range, args) for rowid_range in ranges] or [(tab, None, None, args)]
+
+def extract_unit(unit) -> dict:
+    """ extract table, partition or ROWID range to compressed COPY files in own ORA session """
+    tab, partition, rowid_range, args = unit
     dbora = cx_Oracle.connect(args.ora_uri)
+    curs = dbora.cursor()
+    curs.outputtypehandler = blob_output_type_handler
+    try:
+        query = ora_select_query(tab, args, partition)
+        params = {}
+        if rowid_range is not None:
+            query += " where rowid between :low and :high"
+            params = {'low': rowid_range[1], 'high': rowid_range[2]}
+        LOGGER.debug("query=%s, params=%s", query, params)
+        curs.execute(query, params)
+        cols = [col[0] for col in curs.description]
+        encoder = build_row_encoder(curs.description, [])
+
+        files = []
+        rows = args.throttle.fetch(curs, args.batch_rowcount)
+        while rows:
+            filename = extract_file_name(tab, partition, len(files), args.compress, rowid_range)
+            digest = hashlib.sha256()
+            file_rows = 0
+            with open_compressed(os.path.join(args.dest_dir, filename), 'wb',
+                                 args.compress, args.compress_level) as out:
+                while rows and (not args.chunk_rows or file_rows < args.chunk_rows):
+                    data = b''.join(map(encoder.copy_row, rows))
+                    args.throttle.consume_bytes(len(data))
+                    out.write(data)
+                    digest.update(data)
+                    file_rows += len(rows)
+                    rows = args.throttle.fetch(curs, args.batch_rowcount)
+            LOGGER.info('%s: %d rows', filename, file_rows)
+            files.append({'file': filename, 'rows': file_rows, 'sha256': digest.hexdigest()})
+    finally:
+        curs.close()
+        dbora.close()
+    entry = {'table': tab, 'partition': partition, 'columns': cols, 'files': files}
+    if rowid_range is not None:
+        entry['rowid_range'] = list(rowid_range[1:])
+    return entry
+
+def extract_tables(curs, args):
+    """ extract tables to DEST_DIR in parallel and write manifest """
+    partitioned = get_ora_partitioned_tabs(curs)
+    units = []
+    for tab in args.tables_to_copy:
+        units += extract_units(curs, tab, partitioned, args)
+
+    os.makedirs(args.dest_dir, exist_ok=True)
+    with Pool(args.sessions) as pool:
+        entries = list(tqdm(pool.imap(extract_unit, units), desc='extract', total=len(units)))
+
+    manifest = {
+        'created': datetime.datetime.now().isoformat(),
+        'compress': args.compress,
+        'tables': entries,
+    }
+    with open(os.path.join(args.dest_dir, MANIFEST_FILE), 'w') as file:
+        json.dump(manifest, file, indent=1)
+    print('extracted %d rows to %d files' % (
+        sum(f['rows'] for e in entries for f in e['files']),
+        sum(len(e['files']) for e in entries)))
+
+def hashed_blocks(src, digest):
+    """ read COPY data by blocks for load_chunks """
+    for block in iter(lambda: src.read(LOAD_BLOCK_SIZE), b''):
+        digest.update(block)
+        yield [block]
+
+def load_file(unit):
+    """ stream compressed COPY file into PG in own session, returns error or None """
+    tab, cols, entry, args = unit
+    pg_query = "copy " + tab + "(" + ','.join([mask_col(col) for col in cols]) + ") from STDIN"
+    dbpg = postgresql.open(args.pg_uri)
+    try:
+        LOGGER.debug('%s < %s', pg_query, entry['file'])
+        digest = hashlib.sha256()
+        with open_compressed(os.path.join(args.src_dir, entry['file']), 'rb') as src, \
+             dbpg.xact():
+            dbpg.prepare(pg_query).load_chunks(hashed_blocks(src, digest))
+            if digest.hexdigest() != entry['sha256']:
+                # rollback the file
+                raise Exception('checksum mismatch')
+        LOGGER.info('%s: %d rows loaded', entry['file'], entry['rows'])
+        return None
+    except Exception as ex:
+        LOGGER.error('%s: %s', entry['file'], ex)
+        return '%s: %s' % (entry['file'], ex)
+    finally:
+        dbpg.close()
+
+def load_tables(dbpg, args):
+    """ load extracted files to PG by parallel COPY sessions """
+    with open(os.path.join(args.src_dir, MANIFEST_FILE)) as file:
+        manifest = json.load(file)
+
+    entries = [e for e in manifest['tables']
+               if not args.tables_to_copy or e['table'] in args.tables_to_copy]
+    tables = reorder_tables(list(OrderedDict.fromkeys(e['table'] for e in entries)))
+
+    if args.disable_trigs:
+        pg_disable_triggers(dbpg, tables)
+
+    if args.truncate_tabs:
+        if args.force or confirm_truncate_tabs():
+            pg_truncate_tabs(dbpg, tables)
+        else:
+            print('Not confirmed, exiting...')
+            return
+
+    units = [(e['table'], e['columns'], f, args) for e in entries for f in e['files']]
+    with Pool(args.sessions) as pool:
+        pbar = tqdm(desc='load', total=sum(f['rows'] for e in entries for f in e['files']))
+        errors = []
+        for unit, error in zip(units, pool.imap(load_file, units)):
+            if error:
+                errors.append(error)
+            pbar.update(unit[2]['rows'])
+        pbar.close()
+
+    if args.disable_trigs:
+        pg_enable_triggers(dbpg, tables)
+
+    for error in errors:
+        print(error)
+    print('load done, %d of %d files failed' % (len(errors), len(units)))
 
+def extract_main(args):
+    """ extract command """
+    dbora = cx_Oracle.connect(args.ora_uri)
     curs = dbora.cursor()
+    apply_exclude_list(curs, args)
+    capture_scn(curs, args)
+    extract_tables(curs, args)
+    curs.close()
+
+def load_main(args):
+    """ load command """
+    dbpg = postgresql.open(args.pg_uri)
+    load_tables(dbpg, args)
+
+def capture_scn(curs, args):
+    """ --consistent: all source queries read AS OF SCN taken once at start """
+    if args.consistent and args.scn is None:
+        args.scn = ora_current_scn(curs)
+    if args.scn is not None:
+        LOGGER.info('reading oracle AS OF SCN %d', args.scn)
+        print('AS OF SCN %d' % args.scn)
+        for tab, query in args.replace_query.items():
+            # fail before copying if a replaced query can't be read AS OF SCN
+            ora_query_as_of(query, tab, args.scn)
+
+def apply_exclude_list(curs, args):
+    """ all user tables excluding --exclude-list """
     if args.exclude_list:
         args.tables_to_copy = get_ora_user_tabs(curs)
         for excl in args.exclude_list:
             if excl in args.tables_to_copy:
                 args.tables_to_copy.remove(excl)
 
+def main(args):
+    """ main """
+    LOGGER.debug('binary cols=%s', args.bin_cols)
+    if args.max_mb_per_sec and not args.use_copy:
+        resstr = '--max-mb-per-sec limits COPY bytes, ' \
+                 'without --use-copy only --max-rows-per-sec applies'
+        LOGGER.warning(resstr)
+        print(resstr)
+
+
+    dbpgs = [postgresql.open(uri) for uri in args.pg_uris]
+    dbora = cx_Oracle.connect(args.ora_uri)
+
+    curs = dbora.cursor()
+    apply_exclude_list(curs, args)
+
     if args.cmp_tab_list:
         cmp_tab_list(curs, args)
         return
     if args.seq_last_number_fix:
-        pg_seq_last_number_fix(curs, dbpg)
+        for dbpg in dbpgs:
+            pg_seq_last_number_fix(curs, dbpg)
         return
+
+    capture_scn(curs, args)
     if args.compare:
-        compare_tables(curs, dbpg, args)
+        for uri, dbpg in zip(args.pg_uris, dbpgs):
+            if len(dbpgs) > 1:
+                print(target_name(uri))
+            compare_tables(curs, dbpg, args)
         return
     if args.drop_fk:
-        pg_drop_fk(dbpg, args.tables_to_copy)
+        for_each_pg(dbpgs, pg_drop_fk, args.tables_to_copy)
         return
     if args.disable_trigs:
-        pg_disable_triggers(dbpg, args.tables_to_copy)
+        for_each_pg(dbpgs, pg_disable_triggers, args.tables_to_copy)
 
-    if args.truncate_tabs:
+    if args.truncate_tabs or args.fast_load:
         if args.force or confirm_truncate_tabs():
-            pg_truncate_tabs(dbpg, args.tables_to_copy)
+            if not args.fast_load: # fast load truncates tables in the COPY transaction
+                for_each_pg(dbpgs, pg_truncate_tabs, args.tables_to_copy)
         else:
             print('Not confirmed, exiting...')
             return
 
+    args.run_id = start_run(args, ' '.join(sys.argv))
+    if args.auto_tune:
+        args.tables_to_copy = auto_tune(args, args.tables_to_copy)
     args.tables_to_copy = reorder_tables(args.tables_to_copy)
 
-    copy_tables(curs, dbpg, args)
+    if args.fast_load:
+        # SET UNLOGGED of partitioned table does not apply to its partitions
+        args.pg_partitions = pg_partitioned_tabs(dbpgs[0], args.tables_to_copy)
+        unlogged_tabs = fast_load_tabs(args.tables_to_copy, args.pg_partitions)
+        with timed_phase(args, 'set unlogged'):
+            for dbpg in dbpgs:
+                pg_fast_load_session(dbpg)
+                for tab in unlogged_tabs:
+                    pg_set_logged_tab(dbpg, tab, False)
+        try:
+            with timed_phase(args, 'copy'):
+                copy_tables(curs, dbpgs, args)
+        finally:
+            with timed_phase(args, 'set logged'):
+                for dbpg in dbpgs:
+                    for tab in unlogged_tabs:
+                        pg_set_logged_tab(dbpg, tab, True)
+    else:
+        with timed_phase(args, 'copy'):
+            copy_tables(curs, dbpgs, args)
 
     if args.disable_trigs:
-        pg_enable_triggers(dbpg, args.tables_to_copy)
+        for_each_pg(dbpgs, pg_enable_triggers, args.tables_to_copy)
+
+    print_phase_times(args)
+    if len(dbpgs) > 1:
+        print_target_status(args)
 
     curs.close()
 
@@ -382,6 +1574,99 @@ def replace_query2dict(qlist: list('tab[query]')) -> dict:
         res_dict[tab] = query[:-1]
     return res_dict
 
+def normalize_table_args(args):
+    """ table list options to lists & dicts """
+    args.tables_to_copy = tabs2list(args.tables_to_copy)
+    if getattr(args, 'exclude_list', None) is not None:
+        args.exclude_list = tabs2list(args.exclude_list)
+
+    if getattr(args, 'replace_query', None) is not None:
+        args.replace_query = replace_query2dict(args.replace_query)
+    else:
+        args.replace_query = {}
+    args.columns = {} # columns to copy per table, see plan_columns
+
+def parse_extract_arg(argv):
+    """ parse extract command options """
+    parser = argparse.ArgumentParser(prog='ora2pg.py extract',
+                                     description="Extract ORA tables to compressed COPY files")
+    parser.add_argument('--destination-dir', '-d', dest='dest_dir', default='extract',
+                        help='directory for COPY files and %s, default=%%(default)s' % MANIFEST_FILE)
+    parser.add_argument('--table-list', '-l', dest='tables_to_copy', type=str,
+                        help='coma separate list of tables to extract.')
+    parser.add_argument('--exclude-list', '-x', dest='exclude_list', type=str,
+                        help='Exclude table list (comma separated). '
+                             'Extract all tables in schema excluding this list')
+    parser.add_argument('--replace-query', nargs="*", dest='replace_query',
+                        help='replase query for table, format: table_name[select * from table_name where cond=some_value]')
+    parser.add_argument('--batch-copy-rowcount', '-b', dest='batch_rowcount', type=int,
+                        default=6000,
+                        help='number of rows to fetch at once, default=%(default)s')
+    parser.add_argument('--consistent', dest='consistent', action='store_true',
+                        help='read all tables AS OF oracle SCN captured once at start, '
+                             'needs enough UNDO retention for the whole run')
+    parser.add_argument('--scn', dest='scn', type=int, default=None,
+                        help='read all tables AS OF this oracle SCN')
+    parser.add_argument('--chunk-rows', dest='chunk_rows', type=int, default=0,
+                        help='split not partitioned tables to ROWID ranges of about this number '
+                             'of rows by statistics, extracted in parallel, and start new file '
+                             'after this number of rows, 0 - file per table (partition), '
+                             'default=%(default)s')
+    parser.add_argument('--compress', dest='compress', choices=sorted(COMPRESS_EXT), default='gzip',
+                        help='compression, default=%(default)s')
+    parser.add_argument('--compress-level', dest='compress_level', type=int, default=1,
+                        help='compression level, default=%(default)s')
+    parser.add_argument('--sessions', dest='sessions', default=4, type=int,
+                        help='Number of parallel ORA sessions, default=%(default)s')
+    add_throttle_args(parser)
+    add_log_args(parser, 'ora2pg.log')
+    parser.add_argument(dest='ora_uri', help='ORA connect string')
+    args = parser.parse_args(argv)
+    normalize_table_args(args)
+    args.throttle = Throttle(args, 1 / args.sessions)
+    return args
+
+def parse_load_arg(argv):
+    """ parse load command options """
+    parser = argparse.ArgumentParser(prog='ora2pg.py load',
+                                     description="Load COPY files made by extract command to PG")
+    parser.add_argument('--table-list', '-l', dest='tables_to_copy', type=str,
+                        help='coma separate list of tables to load, default - all from %s' % MANIFEST_FILE)
+    parser.add_argument('--truncate-tables', '-z', dest='truncate_tabs', action='store_true',
+                        help='truncate tables before load')
+    parser.add_argument('--disable-triggers', '-t', dest='disable_trigs', action='store_true',
+                        help='disable triggers before load')
+    parser.add_argument('--force', dest='force', action='store_true', help="Don't ack, just do")
+    parser.add_argument('--sessions', dest='sessions', default=4, type=int,
+                        help='Number of parallel PG COPY sessions, default=%(default)s')
+    add_log_args(parser, 'ora2pg.log')
+    parser.add_argument(dest='src_dir', help='directory with %s' % MANIFEST_FILE)
+    parser.add_argument(dest='pg_uri', help='PG connect string, pq://...')
+    args = parser.parse_args(argv)
+    normalize_table_args(args)
+    return args
+
+def parse_history_arg(argv):
+    """ parse history command options """
+    parser = argparse.ArgumentParser(prog='ora2pg.py history',
+                                     description="Per table results of previous copy runs")
+    parser.add_argument('--history-db', dest='history_db', default='ora2pg_history.db',
+                        help='SQLite database of per table results, default=%(default)s')
+    parser.add_argument('--table-list', '-l', dest='tables_to_copy', type=str,
+                        help='coma separate list of tables to show, default - all')
+    parser.add_argument('--runs', dest='runs', type=int, default=5,
+                        help='number of last runs per table, default=%(default)s')
+    add_log_args(parser, 'ora2pg.log')
+    args = parser.parse_args(argv)
+    normalize_table_args(args)
+    return args
+
+COMMANDS = {
+    'extract': (parse_extract_arg, extract_main),
+    'load': (parse_load_arg, load_main),
+    'history': (parse_history_arg, history_report),
+}
+
 def parse_arg():
     """ parse program options """
     parser = argparse.ArgumentParser(description="Ora2Pg copy tables")
@@ -395,21 +1680,57 @@ def parse_arg():
     parser.add_argument('--table-list', '-l', dest='tables_to_copy', type=str,
                         help='coma separate list of tables to copy.')
     parser.add_argument('--binary-col', dest='bin_cols', action='append',
-                        help='coma separate list of binary columns, use without --use-copy key')
+                        help='VARCHAR2 column with cp866 binary data loaded to bytea, may be '
+                             'repeated. RAW & BLOB columns are detected without it')
     parser.add_argument('--use-copy', dest='use_copy', action='store_true',
                         help='use PG COPY command to copy data')
-    parser.add_argument('--log-file', default='ora2pg.log', dest='log_file',
-                        help='log file, default=%(default)s')
+    parser.add_argument('--fast-load', dest='fast_load', action='store_true',
+                        help='initial full load: UNLOGGED tables, truncate and COPY FREEZE '
+                             'in one transaction, synchronous_commit=off. Implies --use-copy '
+                             'and truncates tables. Drop foreign keys first (--fk-drop)')
+    parser.add_argument('--ora-format', dest='ora_format', action='store_true',
+                        help='With --use-copy: oracle formats COPY lines (NUMBER(p), DATE, '
+                             'VARCHAR2, CHAR columns only, other tables use python encoder)')
+    parser.add_argument('--ora-format-check', dest='ora_format_check', type=int, default=1000,
+                        help='With --ora-format: compare oracle COPY lines with python encoder '
+                             'on this number of first rows, default=%(default)s')
+    parser.add_argument('--columnar', dest='columnar', action='store_true',
+                        help='With --use-copy: fetch NUMBER & DATE columns as text converted by '
+                             'oracle client and encode batches column by column')
+    parser.add_argument('--max-buffer-mb', dest='max_buffer_mb', type=float, default=64,
+                        help='limit in MB of COPY data sent at once, batch is flushed to PG early '
+                             'when exceeded, default=%(default)s')
+    add_log_args(parser, 'ora2pg.log')
     parser.add_argument('--exclude-list', '-x', dest='exclude_list', type=str,
                         help='Exclude table list (comma separated). '
                              'Copy all tables in schema excluding this list')
     parser.add_argument('--skip-count', dest='skip_count', action='store_true',
-                        help='Do not perform counting rows before copy. Disables progress bar.')
+                        help='Do not use rowcount for progress bar at all.')
+    parser.add_argument('--exact-count', dest='exact_count', action='store_true',
+                        help='Progress bar total is taken from optimizer statistics (num_rows), '
+                             'refine it by exact count(*) running in a second session during copy.')
     parser.add_argument('--replace-query', nargs="*", dest='replace_query',
                         help='replase query for table, format: table_name[select * from table_name where cond=some_value]')
     parser.add_argument('--force', dest='force', action='store_true', help="Don't ack, just do")
     parser.add_argument('--processes', dest='processes', default='1', type=int,
                         help='Number of processes to decode data to COPY in PG, default=%(default)s')
+    parser.add_argument('--consistent', dest='consistent', action='store_true',
+                        help='read all tables AS OF oracle SCN captured once at start, '
+                             'needs enough UNDO retention for the whole run')
+    parser.add_argument('--scn', dest='scn', type=int, default=None,
+                        help='read all tables AS OF this oracle SCN')
+    parser.add_argument('--small-table-rows', dest='small_table_rows', type=int, default=0,
+                        help='With --use-copy: tables with less rows (user_tables.num_rows) are '
+                             'fetched in one round trip and loaded by groups in one PG transaction, '
+                             'e.g. 1000, default=%(default)s (off)')
+    parser.add_argument('--small-table-group', dest='small_table_group', type=int, default=50,
+                        help='Number of small tables loaded in one PG transaction, default=%(default)s')
+    parser.add_argument('--sessions', dest='sessions', default=1, type=int,
+                        help='Number of parallel ORA & PG sessions to copy partitions of '
+                             'partitioned tables, default=%(default)s')
+    parser.add_argument('--route-partitions', dest='route_partitions', action='store_true',
+                        help='Load RANGE & LIST partitions directly into PG partitions '
+                             'created by gen_pg_tabs.py, skips PG tuple routing')
     parser.add_argument('--fk-drop', '-f', dest='drop_fk', action='store_true',
                         help='Drop foreign keys in PG and exit')
     parser.add_argument('--cmp', dest='compare', action='store_true',
@@ -418,44 +1739,45 @@ def parse_arg():
                         help='Compare table list - user input and oracle user_tables and exit')
     parser.add_argument('--seq-last-number-fix', dest='seq_last_number_fix', action='store_true',
                         help='Update sequences last numbers and exit')
-    parser.add_argument(dest='pg_uri', help='PG connect string, pq://...')
+    parser.add_argument('--shard-key', nargs='*', dest='shard_keys', default=[],
+                        help='With several pg_uri: route rows of table to one of PG nodes by '
+                             'crc32 of column text %% number of nodes instead of loading them '
+                             'everywhere, format: table_name[column]')
+    parser.add_argument('--target-buffer', dest='target_buffer', type=int, default=4,
+                        help='With several pg_uri: number of batches a slow PG target may lag '
+                             'behind before fetching waits for it, default=%(default)s')
+    add_throttle_args(parser)
+    add_history_args(parser)
+    add_profile_args(parser)
+    parser.add_argument(dest='pg_uris', nargs='+', metavar='pg_uri',
+                        help='PG connect string, pq://..., several targets get the same data')
     parser.add_argument(dest='ora_uri', help='ORA connect string')
 
     args = parser.parse_args()
-    args.tables_to_copy = tabs2list(args.tables_to_copy)
-    if args.exclude_list is not None:
-        args.exclude_list = tabs2list(args.exclude_list)
-
-    if args.replace_query is not None:
-        args.replace_query = replace_query2dict(args.replace_query)
-    else:
-        args.replace_query = {}
+    normalize_table_args(args)
 
     if args.bin_cols is None:
         args.bin_cols = []
+    args.shard_keys = {tab.upper(): col.upper()
+                       for tab, col in replace_query2dict(args.shard_keys).items()}
+    if args.fast_load:
+        args.use_copy = True
+    args.max_buffer_size = int(args.max_buffer_mb * 1024 * 1024)
+    args.pg_uri = args.pg_uris[0]
+    args.phase_times = OrderedDict()
+    args.target_status = OrderedDict()
+    args.throttle = Throttle(args)
+    args.default_batch_rowcount = args.batch_rowcount
+    args.batch_sizes = {} # per table (partition) batch size by --auto-tune
+    args.pg_partitions = {} # --fast-load: PG partitioned tables & their partitions
     return args
 
-def backup_logfile_name(filename):
-    filename_comp = filename.split('.')
-    timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-    if filename_comp[-1] == 'log':
-        filename_comp = filename_comp[:-1] + [timestamp] + filename_comp[-1:]
-    else:
-        filename_comp.append(timestamp)
-    return '.'.join(filename_comp)
-
-def rotate_logfile(filename):
-    """ move logfile """
-    import os.path
-    import os
-    if os.path.isfile(filename):
-        os.rename(filename, backup_logfile_name(filename))
-
 if __name__ == '__main__':
-    LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name) -30s %(funcName) '
-                  '-35s %(lineno) -5d: %(message)s')
-    args = parse_arg()
-    rotate_logfile(args.log_file)
-    logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT, filename=args.log_file)
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        parse_command_arg, command_main = COMMANDS[sys.argv[1]]
+        args = parse_command_arg(sys.argv[2:])
+    else:
+        args, command_main = parse_arg(), main
+    start_logging(args)
     LOGGER.info(' '.join(sys.argv))
-    main(args)
+    command_main(args)
@@ -2,19 +2,29 @@ import logging
 import logging.handlers
 import datetime
 import sys
+import re
 import argparse
 from collections import namedtuple
 import postgresql # pip install py-postgresql
+from postgresql.types import BOOLOID, BYTEAOID, DATEOID, TIMESTAMPOID, TIMESTAMPTZOID
 import cx_Oracle # pip install cx_Oracle
 from tqdm import trange, tqdm
 
-from ora2pg import get_ora_user_tabs, backup_logfile_name, tabs2list
+from ora2pg import get_ora_user_tabs, tabs2list
 from ora2pg import confirm_truncate_tabs
 from ora2pg import pg_count_rows,reorder_tables, replace_query2dict, get_count_rows_tab_cond
-from ora2pg import mask_col, pg_get_seq_last_value
+from ora2pg import mask_col, chunks, pg_get_seq_last_values, ora_get_seq_last_numbers
+from ora2pg import SEQ_BLOCK_SIZE, DDL_BLOCK_SIZE, ora_copy_session
+from profiling import add_profile_args, new_profile, profile_batch, save_profile
+from logsetup import add_log_args, start_logging
 
 LOGGER = logging.getLogger(__name__)
 
+COPY_UNESCAPE = re.compile(r'\\(?:([0-7]{1,3})|x([0-9a-fA-F]{1,2})|(.))', re.S)
+COPY_UNESCAPE_CHARS = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v'}
+COPY_TIMESTAMP = re.compile(r'(\d{4})-(\d\d)-(\d\d)(?: (\d\d):(\d\d):(\d\d)(?:\.(\d{1,6}))?)?'
+                            r'(?:([+-])(\d\d)(?::(\d\d))?(?::(\d\d))?)?$')
+
 def clear_ora_data_by_cond(curs, tab, cond, timestamp):
     """ clear PG data by cond """
     query = 'delete from ' + tab + ' ' + cond
@@ -34,6 +44,122 @@ def pg_count_rows(dbpg, tab, args) -> int:
     return qcount()[0]['count']
 
 
+def copy_unescape_match(match):
+    """ replacement for COPY_UNESCAPE """
+    octal, hexa, char = match.groups()
+    if octal:
+        return chr(int(octal, 8))
+    if hexa:
+        return chr(int(hexa, 16))
+    return COPY_UNESCAPE_CHARS.get(char, char)
+
+def copy_field(field):
+    """
+        PG COPY text field to python str
+        >>> copy_field('a\\\\tb\\\\\\\\c'), copy_field('\\\\N')
+        ('a\\tb\\\\c', None)
+    """
+    if field == '\\N':
+        return None
+    return COPY_UNESCAPE.sub(copy_unescape_match, field)
+
+def copy_bytea(field):
+    """
+        >>> copy_bytea('\\\\x01ff')
+        b'\\x01\\xff'
+    """
+    return bytes.fromhex(field[2:])
+
+def copy_bool(field):
+    """ PG boolean to NUMBER(1) """
+    return 1 if field == 't' else 0
+
+def copy_timestamp(field):
+    """
+        PG timestamp, timestamptz (DateStyle ISO) to datetime, timestamptz in UTC
+        as read by prepared statement. infinity & BC are left to oracle
+        >>> copy_timestamp('2019-01-02 03:04:05.25')
+        datetime.datetime(2019, 1, 2, 3, 4, 5, 250000)
+        >>> copy_timestamp('2019-01-02 03:04:05+03')
+        datetime.datetime(2019, 1, 2, 0, 4, 5, tzinfo=datetime.timezone.utc)
+    """
+    match = COPY_TIMESTAMP.match(field)
+    if match is None:
+        return field
+    year, month, day, hour, minute, second, fraction, sign, tzh, tzm, tzs = match.groups()
+    value = datetime.datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0),
+                              int(second or 0), int((fraction or '0').ljust(6, '0')))
+    if sign is None:
+        return value
+    offset = datetime.timedelta(hours=int(tzh), minutes=int(tzm or 0), seconds=int(tzs or 0))
+    tzinfo = datetime.timezone(-offset if sign == '-' else offset)
+    return value.replace(tzinfo=tzinfo).astimezone(datetime.timezone.utc)
+
+def copy_date(field):
+    """
+        >>> copy_date('2019-01-02')
+        datetime.date(2019, 1, 2)
+    """
+    value = copy_timestamp(field)
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+COPY_CONVERTERS = {
+    BYTEAOID: copy_bytea,
+    BOOLOID: copy_bool,
+    DATEOID: copy_date,
+    TIMESTAMPOID: copy_timestamp,
+    TIMESTAMPTZOID: copy_timestamp,
+}
+
+def copy_converters(pg_column_types) -> dict:
+    """
+        {column position: converter} for columns Oracle can't take as text:
+        fractional seconds & time zones do not fit NLS_DATE_FORMAT of DATE columns
+    """
+    return {n: COPY_CONVERTERS[type_oid] for n, type_oid in enumerate(pg_column_types)
+            if type_oid in COPY_CONVERTERS}
+
+def parse_copy_lines(lines, converters) -> list:
+    """
+        PG COPY text lines to Oracle bind rows
+        >>> parse_copy_lines([b'1\\tabc\\tf\\n', b'2\\t\\\\N\\tt\\n'], {2: copy_bool})
+        [['1', 'abc', 0], ['2', None, 1]]
+    """
+    rows = []
+    text = b''.join(lines).decode('utf-8')
+    for line in text.split('\n')[:-1]:
+        fields = line.split('\t')
+        if '\\' in line:
+            fields = [copy_field(field) if '\\' in field else field for field in fields]
+        for n, converter in converters.items():
+            if fields[n] is not None:
+                fields[n] = converter(fields[n])
+        rows.append(fields)
+    return rows
+
+def ora_insert_batch(curs, ora_query, rows, pbar):
+    """ insert rows to oracle and commit """
+    curs.executemany(ora_query, rows, batcherrors=True)
+    for errorObj in curs.getbatcherrors():
+        LOGGER.error("Row %s has error %s", errorObj.offset, errorObj.message,
+                     extra={'table': pbar.desc})
+    pbar.update(len(rows))
+    curs.execute("commit")
+
+def copy_out_batches(dbpg, query, pgq, batch_rowcount):
+    """ source rows from COPY (query) TO STDOUT by batches """
+    copy_query = "COPY (" + query + ") TO STDOUT"
+    LOGGER.debug(copy_query)
+    converters = copy_converters(pgq.pg_column_types)
+    rows = []
+    for lines in dbpg.prepare(copy_query).chunks():
+        rows += parse_copy_lines(lines, converters)
+        if len(rows) >= batch_rowcount:
+            yield rows
+            rows = []
+    if rows:
+        yield rows
+
 def copy_table(curs, dbpg, tab, args):
     query = "select * from " + tab
     if tab in args.replace_query:
@@ -54,13 +180,16 @@ def copy_table(curs, dbpg, tab, args):
 
     LOGGER.debug(ora_query)
 
-    for chunk in pgq.chunks():
-        curs.executemany(ora_query, chunk, batcherrors=True)
-        for errorObj in curs.getbatcherrors():
-            print("Row", errorObj.offset, "has error", errorObj.message)
-            LOGGER.error("Row %s has error %s", errorObj.offset, errorObj.message)
-        pbar.update(len(chunk))
-        curs.execute("commit")
+    if args.use_copy:
+        batches = copy_out_batches(dbpg, query, pgq, args.batch_rowcount)
+    else:
+        batches = pgq.chunks()
+
+    prof = new_profile(args)
+    for batch_no, chunk in enumerate(batches):
+        with profile_batch(prof, args, batch_no):
+            ora_insert_batch(curs, ora_query, chunk, pbar)
+    save_profile(prof, args, tab)
     pbar.close()
     curs.execute("commit")
 
@@ -72,67 +201,66 @@ def copy_tables(curs, dbpg, args):
 
 def ora_seq_last_number_fix(curs, dbpg):
     """ update sequences last number: PG->ORA """
-    seq_qry = """SELECT relname FROM pg_class WHERE relkind = 'S'"""
-    seq_list = dbpg.prepare(seq_qry)
-    for seq in seq_list():
-        seq_name = seq[0]
-        last_value = pg_get_seq_last_value(dbpg, seq_name)
-        ora_seq_qry = """SELECT last_number FROM user_sequences where sequence_name=:seq_name"""
-        curs.execute(ora_seq_qry, {":seq_name": seq_name.upper()})
-        ora_last_value_row = curs.fetchone()
-
-        if ora_last_value_row is None:
+    ora_seqs = ora_get_seq_last_numbers(curs)
+
+    seq_fixes = []
+    for seq_name, last_value in sorted(pg_get_seq_last_values(dbpg).items()):
+        ora_last_value = ora_seqs.get(seq_name)
+        if ora_last_value is None:
             LOGGER.debug("no data in ORA for seq: %s", seq_name)
 
-        ora_last_value = None if ora_last_value_row is None else ora_last_value_row[0]
         if ora_last_value and ora_last_value < last_value:
-            curs.execute("alter sequence " + seq_name + " increment by " + str(last_value - ora_last_value + 1))
-            curs.execute("select " + seq_name + ".nextval from dual")
-            curs.fetchall()
-            curs.execute("alter sequence " + seq_name + " increment by 1")
-            LOGGER.debug("oracle seq %s.last_value incremented by %d", seq_name, last_value - ora_last_value + 1)
+            increment = last_value - ora_last_value + 1
+            seq_fixes.append(
+                "EXECUTE IMMEDIATE 'alter sequence %(seq)s increment by %(inc)d';\n"
+                "EXECUTE IMMEDIATE 'select %(seq)s.nextval from dual' INTO v;\n"
+                "EXECUTE IMMEDIATE 'alter sequence %(seq)s increment by 1';"
+                % {'seq': seq_name, 'inc': increment})
+            LOGGER.debug("oracle seq %s.last_value incremented by %d", seq_name, increment)
         else:
             LOGGER.debug("nothing to do with oracle seq %s", seq_name)
 
-def ora_get_constraints(curs, table_name) -> list:
-    """ list of foreign keys for the table_name """
-    fk_query = """SELECT constraint_name
-FROM ALL_CONSTRAINTS where
-  table_name=:table_name
-  and CONSTRAINT_TYPE = 'R'"""
-    LOGGER.debug('execute: %s params=%s', fk_query, {":table_name": table_name})
-    curs.execute(fk_query, {":table_name": table_name})
-    return [row[0] for row in curs.fetchall()]
+    for block in chunks(seq_fixes, SEQ_BLOCK_SIZE):
+        curs.execute("DECLARE\n  v NUMBER;\nBEGIN\n" + "\n".join(block) + "\nEND;")
+
+def ora_tables_constraints(curs) -> dict:
+    """ {table: [foreign key, ...]} of user tables, one dictionary query """
+    fk_query = """SELECT table_name, constraint_name
+FROM USER_CONSTRAINTS where
+  CONSTRAINT_TYPE = 'R'
+ORDER BY table_name, constraint_name"""
+    LOGGER.debug('execute: %s', fk_query)
+    curs.execute(fk_query)
+    constraints = {}
+    for tab, constr in curs.fetchall():
+        constraints.setdefault(tab, []).append(constr)
+    return constraints
+
+def ora_execute_blocks(cur, statements):
+    """ execute DDL statements by PL/SQL blocks of DDL_BLOCK_SIZE """
+    for block in chunks(statements, DDL_BLOCK_SIZE):
+        query = "BEGIN\n" + "\n".join(["EXECUTE IMMEDIATE '%s';" % stmt for stmt in block]) + \
+                "\nEND;"
+        LOGGER.debug(query)
+        cur.execute(query)
 
 def ora_disable_fk(cur, tables_list):
     """ disable foreign key check on table list """
-    for tab in tables_list:
-        for constr in ora_get_constraints(cur, tab):
-            q = "ALTER TABLE " + tab + " DISABLE CONSTRAINT " + constr
-            LOGGER.debug(q)
-            cur.execute(q)
+    constraints = ora_tables_constraints(cur)
+    ora_execute_blocks(cur, ["ALTER TABLE " + tab + " DISABLE CONSTRAINT " + constr
+                             for tab in tables_list for constr in constraints.get(tab, [])])
 
 def ora_disable_triggers(cur, tables_list):
     """ disable all triggers on table list """
-    for tab in tables_list:
-        cur.execute("ALTER TABLE " + tab + " DISABLE ALL TRIGGERS")
+    ora_execute_blocks(cur, ["ALTER TABLE " + tab + " DISABLE ALL TRIGGERS" for tab in tables_list])
 
 def ora_enable_triggers(cur, tables_list):
     """ enable all triggers on table list """
-    for tab in tables_list:
-        cur.execute("ALTER TABLE " + tab + " ENABLE ALL TRIGGERS")
-
-def ora_truncate_tab(cur, tab):
-    """ truncate table """
-    query = "truncate table " + tab + " cascade"
-    LOGGER.debug(query)
-    cur.execute(query)
-
+    ora_execute_blocks(cur, ["ALTER TABLE " + tab + " ENABLE ALL TRIGGERS" for tab in tables_list])
 
 def ora_truncate_tabs(cur, tables_list):
     """ truncate tables """
-    for tab in reversed(tables_list):
-        ora_truncate_tab(cur, tab)
+    ora_execute_blocks(cur, ["truncate table " + tab + " cascade" for tab in reversed(tables_list)])
 
 def main(args):
     """ main """
@@ -140,6 +268,8 @@ def main(args):
     dbora = cx_Oracle.connect(args.ora_uri)
 
     curs = dbora.cursor()
+    if args.use_copy:
+        ora_copy_session(curs)
     if args.exclude_list:
         args.tables_to_copy = get_ora_user_tabs(curs)
         for excl in args.exclude_list:
@@ -193,8 +323,7 @@ def parse_arg():
                         help='disable triggers before copy')
     parser.add_argument('--replace-query', nargs="*", dest='replace_query',
                         help='replase query for table, format: table_name[select * from table_name where cond=some_value]')
-    parser.add_argument('--log-file', default='pg2ora.log', dest='log_file',
-                        help='log file, default=%(default)s')
+    add_log_args(parser, 'pg2ora.log')
     parser.add_argument('--fk-drop', '-f', dest='drop_fk', action='store_true',
                         help='Drop foreign keys and exit')
     parser.add_argument('--exclude-list', '-x', dest='exclude_list', type=str,
@@ -202,6 +331,13 @@ def parse_arg():
                              'Copy all tables in schema excluding this list')
     parser.add_argument('--seq-last-number-fix', dest='seq_last_number_fix', action='store_true',
                         help='Update sequences last numbers and exit')
+    parser.add_argument('--use-copy', dest='use_copy', action='store_true',
+                        help='experimental: read PG by COPY (query) TO STDOUT and parse text rows '
+                             'in bulk, not yet measured faster end-to-end, see bench_pg2ora.py')
+    parser.add_argument('--batch-copy-rowcount', '-b', dest='batch_rowcount', type=int,
+                        default=6000,
+                        help='number of rows to insert at once with --use-copy, default=%(default)s')
+    add_profile_args(parser)
 
     args = parser.parse_args()
     args.tables_to_copy = tabs2list(args.tables_to_copy)
@@ -216,18 +352,8 @@ def parse_arg():
     return args
 
 
-def rotate_logfile(filename):
-    """ move logfile """
-    import os.path
-    import os
-    if os.path.isfile(filename):
-        os.rename(filename, backup_logfile_name(filename))
-
 if __name__ == '__main__':
-    LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name) -30s %(funcName) '
-                  '-35s %(lineno) -5d: %(message)s')
     args = parse_arg()
-    rotate_logfile(args.log_file)
-    logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT, filename=args.log_file)
+    start_logging(args)
     LOGGER.info(' '.join(sys.argv))
     main(args)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""
+    cProfile support for --profile option of ora2pg.py, pg2ora.py, gen_pg_tabs.py
+"""
+
+import io
+import os
+import re
+import logging
+import cProfile
+import pstats
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger(__name__)
+
+
+def add_profile_args(parser):
+    """ add profiling options to argument parser """
+    parser.add_argument('--profile', dest='profile_dir', default=None,
+                        help='write cProfile dumps to PROFILE_DIR and top functions to the log')
+    parser.add_argument('--profile-every', dest='profile_every', type=int, default=1,
+                        help='profile every Nth batch only, default=%(default)s')
+    parser.add_argument('--profile-top', dest='profile_top', type=int, default=15,
+                        help='number of hot functions in the log summary, default=%(default)s')
+
+
+def new_profile(args):
+    """ profiler or None if profiling is off """
+    if getattr(args, 'profile_dir', None) is None:
+        return None
+    return cProfile.Profile()
+
+
+@contextmanager
+def profile_batch(prof, args, batch_no):
+    """ profile batch if it is sampled """
+    if prof is None or batch_no % args.profile_every:
+        yield
+        return
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+
+
+def profile_file_name(name):
+    """
+        >>> profile_file_name('SALES:P2019')
+        'sales.p2019.prof'
+    """
+    return re.compile(r'[^a-z0-9_\.]').sub('.', name.lower()) + '.prof'
+
+
+def save_profile(prof, args, name) -> str:
+    """ dump profile to PROFILE_DIR/name.prof, log and return top functions """
+    if prof is None:
+        return ''
+    os.makedirs(args.profile_dir, exist_ok=True)
+    filename = os.path.join(args.profile_dir, profile_file_name(name))
+    prof.dump_stats(filename)
+
+    stream = io.StringIO()
+    stats = pstats.Stats(prof, stream=stream)
+    stats.sort_stats('tottime').print_stats(args.profile_top)
+    summary = '%s profile %s:\n%s' % (name, filename, stream.getvalue())
+    LOGGER.info(summary)
+    return summary
+
+
+@contextmanager
+def profiled(args, name):
+    """ profile the whole block """
+    prof = new_profile(args)
+    try:
+        with profile_batch(prof, args, 0):
+            yield
+    finally:
+        save_profile(prof, args, name)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""
+    rate governor of oracle fetch loops for ora2pg.py:
+    token buckets of rows & bytes per second, limits by time of day schedule,
+    back-off while oracle fetch is slower than threshold
+"""
+
+import json
+import time
+import datetime
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+MAX_BACKOFF_SEC = 60 # longest pause after slow fetches
+
+
+def add_throttle_args(parser):
+    """ add throttling options to argument parser """
+    parser.add_argument('--max-rows-per-sec', dest='max_rows_per_sec', type=float, default=0,
+                        help='fetch at most this number of rows per second (all sessions), '
+                             '0 - no limit, default=%(default)s')
+    parser.add_argument('--max-mb-per-sec', dest='max_mb_per_sec', type=float, default=0,
+                        help='encode at most this number of COPY MB per second (all sessions), '
+                             'INSERT mode is limited by --max-rows-per-sec only, '
+                             '0 - no limit, default=%(default)s')
+    parser.add_argument('--throttle-schedule', dest='throttle_schedule', default=None,
+                        help='JSON file with limits by time of day: [{"from": "08:00", '
+                             '"to": "20:00", "rows_per_sec": 2000, "mb_per_sec": 5}, ...], '
+                             'the options apply outside of listed periods')
+    parser.add_argument('--max-fetch-ms', dest='max_fetch_ms', type=float, default=0,
+                        help='pause fetching, doubling the pause, while oracle fetch of a batch '
+                             'takes longer, 0 - off, default=%(default)s')
+
+
+def load_schedule(filename) -> list:
+    """ periods of schedule file, "from" & "to" as datetime.time """
+    if filename is None:
+        return []
+    with open(filename) as file:
+        periods = json.load(file)
+    for period in periods:
+        period['from'] = datetime.datetime.strptime(period['from'], '%H:%M').time()
+        period['to'] = datetime.datetime.strptime(period['to'], '%H:%M').time()
+    return periods
+
+
+def schedule_limits(periods, now, default) -> tuple:
+    """
+        (rows_per_sec, mb_per_sec) of the period now is in, period may cross midnight
+        >>> periods = [{'from': datetime.time(8), 'to': datetime.time(20), 'rows_per_sec': 2000},
+        ...            {'from': datetime.time(22), 'to': datetime.time(2), 'mb_per_sec': 50}]
+        >>> [schedule_limits(periods, datetime.time(hour), (0, 10)) for hour in (9, 21, 23, 1)]
+        [(2000, 0), (0, 10), (0, 50), (0, 50)]
+    """
+    for period in periods:
+        start, end = period['from'], period['to']
+        if start <= now < end if start <= end else (now >= start or now < end):
+            return period.get('rows_per_sec', 0), period.get('mb_per_sec', 0)
+    return default
+
+
+class Throttle:
+    """ limits of one fetching session, share - its part of the limits """
+
+    def __init__(self, args, share=1.0):
+        self.default = (args.max_rows_per_sec, args.max_mb_per_sec)
+        self.periods = load_schedule(args.throttle_schedule)
+        self.max_fetch_sec = args.max_fetch_ms / 1000
+        self.share = share
+        self.active = bool(any(self.default) or self.periods or self.max_fetch_sec)
+        self.rows_per_sec = self.bytes_per_sec = 0
+        self.rows_tokens = self.bytes_tokens = 0.0
+        self.backoff = 0.0
+        self.last = time.monotonic()
+
+    def refill(self):
+        """ apply current limits and add tokens for time passed, at most one second burst """
+        rows_per_sec, mb_per_sec = schedule_limits(
+            self.periods, datetime.datetime.now().time(), self.default)
+        self.rows_per_sec = rows_per_sec * self.share
+        self.bytes_per_sec = mb_per_sec * 1024 * 1024 * self.share
+        now = time.monotonic()
+        elapsed, self.last = now - self.last, now
+        self.rows_tokens = min(self.rows_tokens + elapsed * self.rows_per_sec, self.rows_per_sec)
+        self.bytes_tokens = min(self.bytes_tokens + elapsed * self.bytes_per_sec, self.bytes_per_sec)
+
+    def wait(self):
+        """ sleep until rows & bytes spent by previous batches are covered by tokens """
+        self.refill()
+        pause = self.backoff
+        if self.rows_per_sec and self.rows_tokens < 0:
+            pause = max(pause, -self.rows_tokens / self.rows_per_sec)
+        if self.bytes_per_sec and self.bytes_tokens < 0:
+            pause = max(pause, -self.bytes_tokens / self.bytes_per_sec)
+        if pause > 0:
+            time.sleep(pause)
+            self.refill()
+
+    def fetch(self, curs, size) -> list:
+        """ fetchmany within limits """
+        if not self.active:
+            return curs.fetchmany(size)
+        self.wait()
+        start = time.monotonic()
+        rows = curs.fetchmany(size)
+        latency = time.monotonic() - start
+        if self.max_fetch_sec and latency > self.max_fetch_sec:
+            self.backoff = min(max(self.backoff * 2, latency), MAX_BACKOFF_SEC)
+            LOGGER.info('fetch took %.2fs, pause %.2fs before next fetch', latency, self.backoff)
+        else:
+            self.backoff = self.backoff / 2 if self.backoff >= 0.01 else 0.0
+        if self.rows_per_sec:
+            self.rows_tokens -= len(rows)
+        return rows
+
+    def consume_bytes(self, nbytes):
+        """ account COPY bytes of fetched batch """
+        if self.bytes_per_sec:
+            self.bytes_tokens -= nbytes
+
+    def postfix(self) -> str:
+        """ applied limits for progress bar """
+        limits = []
+        if self.rows_per_sec:
+            limits.append('%.0f rows/s' % self.rows_per_sec)
+        if self.bytes_per_sec:
+            limits.append('%.1f MB/s' % (self.bytes_per_sec / 1024 / 1024))
+        if self.backoff >= 0.01:
+            limits.append('pause %.2fs' % self.backoff)
+        return ', '.join(limits) or 'no limit'